@@ -0,0 +1,82 @@
+import asyncio
+
+from sqlalchemy import func, select
+from starlette.status import HTTP_200_OK
+
+from SvenBot import utility
+from SvenBot.config import REPO_URL
+from SvenBot.database import A3SyncRevision, database
+
+
+def latest_revision() -> int | None:
+    with database.session() as session:
+        return session.scalar(select(func.max(A3SyncRevision.revision)))
+
+
+def store_revisions(changelogs: list[dict]) -> None:
+    with database.session() as session, session.begin():
+        session.add_all(
+            A3SyncRevision(
+                revision=changelog["revision"],
+                new_addons=changelog["newAddons"],
+                deleted_addons=changelog["deletedAddons"],
+                updated_addons=changelog["updatedAddons"],
+            )
+            for changelog in changelogs
+        )
+
+
+def revisions_between(after: int | None, until: int | None) -> list[A3SyncRevision]:
+    """Stored revisions after `after` up to and including `until`, oldest first, or just the latest without `after`."""
+    query = select(A3SyncRevision)
+    if until is not None:
+        query = query.where(A3SyncRevision.revision <= until)
+
+    if after is None:
+        query = query.order_by(A3SyncRevision.revision.desc()).limit(1)
+    else:
+        query = query.where(A3SyncRevision.revision > after).order_by(A3SyncRevision.revision)
+
+    with database.session() as session:
+        return list(session.scalars(query))
+
+
+async def sync_changelog(repo_revision: int) -> None:
+    """Store the revisions newer than the latest stored one, only downloading the changelog when there are some."""
+    latest = await asyncio.to_thread(latest_revision)
+    if latest is not None and latest >= repo_revision:
+        return
+
+    r = await utility.get([HTTP_200_OK], f"{REPO_URL}/changelog")
+    changelogs = [changelog for changelog in r.json()["list"] if latest is None or changelog["revision"] > latest]
+    await asyncio.to_thread(store_revisions, changelogs)
+
+
+async def get_revisions(after: int | None = None, until: int | None = None) -> list[A3SyncRevision]:
+    return await asyncio.to_thread(revisions_between, after, until)
+
+
+def render_revision(revision: A3SyncRevision) -> str:
+    new = "" if len(revision.new_addons) == 0 else "< New >\n{}".format("\n".join(revision.new_addons))
+    deleted = (
+        "" if len(revision.deleted_addons) == 0 else "\n\n< Deleted >\n{}".format("\n".join(revision.deleted_addons))
+    )
+    updated = (
+        "" if len(revision.updated_addons) == 0 else "\n\n< Updated >\n{}".format("\n".join(revision.updated_addons))
+    )
+    if len(new + deleted + updated) > 0:
+        return f"```md\n{new}{deleted}{updated}\n```\n"
+    return ""
+
+
+def revision_lines(revision: A3SyncRevision) -> list[str]:
+    lines = [f"# Revision {revision.revision} #"]
+    for heading, addons in (
+        ("New", revision.new_addons),
+        ("Deleted", revision.deleted_addons),
+        ("Updated", revision.updated_addons),
+    ):
+        if addons:
+            lines.append(f"< {heading} >")
+            lines.extend(addons)
+    return lines
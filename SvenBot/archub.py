@@ -0,0 +1,88 @@
+from functools import partial
+
+from starlette.status import HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED
+
+from SvenBot import utility
+from SvenBot.cache import AsyncTTLCache, shared_backend
+from SvenBot.config import ARCHUB_API, ARCHUB_HEADERS, settings
+
+
+class ArchubResponse:
+    """A cached ArcHub payload plus what's needed to revalidate it, and anything rendered from it."""
+
+    __slots__ = ("data", "etag", "last_modified", "rendered")
+
+    def __init__(self, data: list[dict], etag: str | None, last_modified: str | None) -> None:
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.rendered: str | None = None
+
+    def as_dict(self) -> dict:
+        return {"data": self.data, "etag": self.etag, "last_modified": self.last_modified}
+
+
+def response_from_dict(path: str, response: dict) -> ArchubResponse:  # noqa: ARG001
+    return ArchubResponse(**response)
+
+
+# Revalidation is a cheap conditional request, so expired entries are refetched rather than served stale
+response_cache: AsyncTTLCache[str, ArchubResponse] = AsyncTTLCache(
+    ttl=settings.ARCHUB_CACHE_TTL,
+    stale_ttl=0,
+    backend=shared_backend("archub", settings.ARCHUB_CACHE_SIZE, ArchubResponse.as_dict, response_from_dict),
+)
+
+
+async def fetch(path: str) -> ArchubResponse:
+    current = response_cache.peek(path)
+    headers = dict(ARCHUB_HEADERS)
+    if current is not None:
+        if current.etag is not None:
+            headers["If-None-Match"] = current.etag
+        if current.last_modified is not None:
+            headers["If-Modified-Since"] = current.last_modified
+
+    r = await utility.get(
+        [HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED],
+        f"{ARCHUB_API}{path}",
+        headers=headers,
+    )
+    if r.status_code == HTTP_304_NOT_MODIFIED and current is not None:
+        return current
+
+    data = r.json() if r.status_code == HTTP_200_OK else []
+    return ArchubResponse(data, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+
+
+async def get(path: str) -> ArchubResponse:
+    return await response_cache.get(path, partial(fetch, path))
+
+
+def render_maps(maps: list[dict]) -> str:
+    lines = ["File name [Display name]", "========================="]
+    lines.extend(
+        _map["class_name"]
+        if _map["class_name"] == _map["display_name"]
+        else f"{_map['class_name']} [{_map['display_name']}]"
+        for _map in maps
+    )
+    return "```ini\n{}\n```".format("\n".join(lines))
+
+
+async def get_maps_text() -> str:
+    response = await get("/maps")
+    if response.rendered is None:
+        response.rendered = render_maps(response.data)
+    return response.rendered
+
+
+async def rename_map(old_name: str, new_name: str) -> None:
+    url = f"{ARCHUB_API}/maps?old_name={old_name}&new_name={new_name}"
+    await utility.patch([HTTP_204_NO_CONTENT], url, headers=ARCHUB_HEADERS)
+    await response_cache.invalidate("/maps")
+
+
+async def get_operation_missions() -> list[dict]:
+    response = await get("/operations/next")
+    return response.data
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, Generic, TypeVar
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from SvenBot.config import settings
+from SvenBot.database import CacheRecord, database
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheEntry(Generic[V]):
+    __slots__ = ("stored_at", "value", "version")
+
+    def __init__(self, value: V, stored_at: float, version: int) -> None:
+        self.value = value
+        self.stored_at = stored_at
+        self.version = version
+
+
+class CacheBackend(ABC, Generic[K, V]):
+    """Where an AsyncTTLCache keeps its entries.
+
+    Every key has a version, bumped each time it's invalidated. A value loaded while a key was at one version is
+    only written if the key is still at it, so nothing read before an invalidation outlives it.
+    """
+
+    @abstractmethod
+    async def read(self, key: K) -> tuple[CacheEntry[V] | None, int]:
+        """The entry for key, if any, and the key's current version."""
+
+    @abstractmethod
+    def peek(self, key: K) -> V | None:
+        """The value for key this process last saw, without checking whether it's still current."""
+
+    @abstractmethod
+    async def write(self, key: K, value: V, version: int) -> None:
+        pass
+
+    @abstractmethod
+    async def modify(self, key: K, change: Callable[[V], None]) -> None:
+        """Apply change to the value stored for key, if there is one, or drop it to be loaded again."""
+
+    @abstractmethod
+    async def invalidate(self, key: K) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend[K, V]):
+    """An LRU of values private to this process."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[K, CacheEntry[V]] = OrderedDict()
+        self._versions: dict[K, int] = {}
+
+    async def read(self, key: K) -> tuple[CacheEntry[V] | None, int]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry, self._versions.get(key, 0)
+
+    def peek(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        return None if entry is None else entry.value
+
+    async def write(self, key: K, value: V, version: int) -> None:
+        if self._versions.get(key, 0) != version:
+            return
+
+        self._entries[key] = CacheEntry(value, time.time(), version)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def modify(self, key: K, change: Callable[[V], None]) -> None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            change(entry.value)
+
+    async def invalidate(self, key: K) -> None:
+        self._versions[key] = self._versions.get(key, 0) + 1
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._versions.clear()
+
+
+def read_record(key: str, known: tuple[float, int] | None) -> tuple[Any, float, int] | None:
+    """The value, stored_at and version for key, leaving the value as None if they're still the known ones."""
+    query = select(CacheRecord.stored_at, CacheRecord.version).where(CacheRecord.key == key)
+    with database.session() as session:
+        row = session.execute(query).one_or_none()
+        if row is None:
+            return None
+
+        stored_at, version = row
+        if (stored_at, version) == known:
+            return None, stored_at, version
+
+        # Decoding the JSON is most of the cost of a read, so it's only fetched when this process hasn't already
+        value = session.execute(select(CacheRecord.value).where(CacheRecord.key == key)).scalar_one()
+    return value, stored_at, version
+
+
+def write_record(key: str, value: Any, stored_at: float, version: int) -> bool:  # noqa: ANN401
+    """Store value if key is still at version, returning whether it was."""
+    query = (
+        update(CacheRecord)
+        .where(CacheRecord.key == key, CacheRecord.version == version)
+        .values(value=value, stored_at=stored_at)
+    )
+    with database.session() as session, session.begin():
+        if session.execute(query).rowcount:
+            return True
+        if version != 0:
+            return False
+
+    try:
+        with database.session() as session, session.begin():
+            session.add(CacheRecord(key=key, value=value, stored_at=stored_at, version=version))
+    except IntegrityError:
+        # Another worker stored or invalidated it first
+        return False
+    return True
+
+
+def invalidate_record(key: str) -> None:
+    query = update(CacheRecord).where(CacheRecord.key == key).values(value=None, version=CacheRecord.version + 1)
+    with database.session() as session, session.begin():
+        if session.execute(query).rowcount:
+            return
+
+    try:
+        with database.session() as session, session.begin():
+            session.add(CacheRecord(key=key, value=None, stored_at=0, version=1))
+    except IntegrityError:
+        invalidate_record(key)
+
+
+class SQLiteBackend(CacheBackend[str, V]):
+    """Values shared by every worker through the database, as JSON.
+
+    Each read checks the key's version, so an invalidation made by any worker is seen by all of them on their next
+    lookup. The values this process decoded are kept, by version, so hits don't decode the JSON again.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_size: int,
+        encode: Callable[[V], Any],
+        decode: Callable[[str, Any], V],
+    ) -> None:
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+        self.max_size = max_size
+        self._decoded: OrderedDict[str, CacheEntry[V]] = OrderedDict()
+
+    def _record_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def read(self, key: str) -> tuple[CacheEntry[V] | None, int]:
+        decoded = self._decoded.get(key)
+        known = None if decoded is None else (decoded.stored_at, decoded.version)
+        record = await asyncio.to_thread(read_record, self._record_key(key), known)
+        if record is None:
+            return None, 0
+
+        value, stored_at, version = record
+        if decoded is not None and (stored_at, version) == known:
+            self._decoded.move_to_end(key)
+            return decoded, version
+        if value is None:
+            return None, version
+
+        decoded = CacheEntry(self.decode(key, value), stored_at, version)
+        self._store_decoded(key, decoded)
+        return decoded, version
+
+    def peek(self, key: str) -> V | None:
+        decoded = self._decoded.get(key)
+        return None if decoded is None else decoded.value
+
+    async def write(self, key: str, value: V, version: int) -> None:
+        stored_at = time.time()
+        if await asyncio.to_thread(write_record, self._record_key(key), self.encode(value), stored_at, version):
+            self._store_decoded(key, CacheEntry(value, stored_at, version))
+
+    async def modify(self, key: str, change: Callable[[V], None]) -> None:  # noqa: ARG002
+        # Patching the stored JSON would mean rewriting all of it, and every worker decoding all of it again
+        await self.invalidate(key)
+
+    async def invalidate(self, key: str) -> None:
+        await asyncio.to_thread(invalidate_record, self._record_key(key))
+        self._decoded.pop(key, None)
+
+    def clear(self) -> None:
+        self._decoded.clear()
+
+    def _store_decoded(self, key: str, entry: CacheEntry[V]) -> None:
+        self._decoded[key] = entry
+        self._decoded.move_to_end(key)
+        while len(self._decoded) > self.max_size:
+            self._decoded.popitem(last=False)
+
+
+def shared_backend(
+    namespace: str,
+    max_size: int,
+    encode: Callable[[V], Any],
+    decode: Callable[[str, Any], V],
+) -> CacheBackend[str, V]:
+    """The backend for a cache every worker should see the same entries of, as chosen by CACHE_BACKEND."""
+    # With a single worker there's nobody to share with, so the database would only add cost
+    if settings.CACHE_BACKEND == "sqlite" and settings.WEB_CONCURRENCY > 1:
+        return SQLiteBackend(namespace, max_size, encode, decode)
+    return MemoryBackend(max_size)
+
+
+class AsyncTTLCache(Generic[K, V]):
+    """TTL cache of awaitable lookups.
+
+    Entries younger than `ttl` are served as-is. Entries younger than `ttl + stale_ttl` are served stale while a
+    single background refresh replaces them. Anything older is treated as a miss, and concurrent misses for the
+    same key in this process share one load.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, backend: CacheBackend[K, V]) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend
+
+        self._loading: dict[K, asyncio.Future[V]] = {}
+        self._refreshes: set[asyncio.Task] = set()
+
+    async def get(self, key: K, loader: Callable[[], Awaitable[V]]) -> V:
+        entry, version = await self.backend.read(key)
+        if entry is not None:
+            age = time.time() - entry.stored_at
+            if age < self.ttl + self.stale_ttl:
+                if age >= self.ttl and key not in self._loading:
+                    self._refresh(key, loader, version)
+                return entry.value
+
+        return await self._load(key, loader, version)
+
+    def peek(self, key: K) -> V | None:
+        return self.backend.peek(key)
+
+    async def modify(self, key: K, change: Callable[[V], None]) -> None:
+        await self.backend.modify(key, change)
+
+    async def invalidate(self, key: K) -> None:
+        self._loading.pop(key, None)
+        await self.backend.invalidate(key)
+
+    def clear(self) -> None:
+        for task in self._refreshes:
+            task.cancel()
+        self._refreshes.clear()
+        self._loading.clear()
+        self.backend.clear()
+
+    async def _load(self, key: K, loader: Callable[[], Awaitable[V]], version: int) -> V:
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future: asyncio.Future[V] = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+
+        try:
+            value = await loader()
+            # Anything invalidated mid-load may have been read before the change, so the backend won't keep it
+            await self.backend.write(key, value, version)
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting on this load, so mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+        future.set_result(value)
+        return value
+
+    def _refresh(self, key: K, loader: Callable[[], Awaitable[V]], version: int) -> None:
+        async def refresh() -> None:
+            try:
+                await self._load(key, loader, version)
+            except Exception as e:
+                gunicorn_logger.error(f"Error refreshing cache entry '{key}':\n{e}")
+
+        task = asyncio.create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
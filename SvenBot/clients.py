@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections.abc import Iterator
+from importlib.util import find_spec
+
+import httpx
+
+from SvenBot.config import ARCHUB_API, DISCORD_HOST, REPO_URL, STEAM_URL, settings
+from SvenBot.resilience import CircuitBreaker, RetryPolicy
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+# Waits shorter than this are just scheduling, not a request held back by a full pool
+POOL_WAIT_THRESHOLD = 0.001
+
+
+class UpstreamStats:
+    __slots__ = ("max_pool_wait", "pool_wait_seconds", "pool_waits", "requests")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.pool_waits = 0
+        self.pool_wait_seconds = 0.0
+        self.max_pool_wait = 0.0
+
+
+class Upstream:
+    """A pooled client for one family of hosts, so a slow upstream can only exhaust its own connections."""
+
+    def __init__(
+        self,
+        name: str,
+        hosts: tuple[str, ...],
+        limits: httpx.Limits,
+        timeout: httpx.Timeout,
+        http2: bool = False,
+    ) -> None:
+        self.name = name
+        self.hosts = hosts
+        self.limits = limits
+        self.timeout = timeout
+        self.http2 = http2
+        self.stats = UpstreamStats()
+        self.retry = RetryPolicy(
+            max_attempts=settings.RETRY_MAX_ATTEMPTS,
+            base_delay=settings.RETRY_BASE_DELAY,
+            max_delay=settings.RETRY_MAX_DELAY,
+            max_elapsed=settings.RETRY_MAX_ELAPSED,
+        )
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+        )
+
+        self._client: httpx.AsyncClient | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        client, _ = self._connection()
+        return client
+
+    def open(self) -> None:
+        self._connection()
+
+    def _connection(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        if self._client is None or self._slots is None:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+            self._slots = asyncio.Semaphore(self.limits.max_connections)
+        return self._client, self._slots
+
+    async def aclose(self) -> None:
+        client, self._client, self._slots = self._client, None, None
+        if client is not None:
+            await client.aclose()
+
+    def reset(self) -> None:
+        self._client, self._slots = None, None
+        self.stats = UpstreamStats()
+        self.breaker.reset()
+
+    async def send(self, request: httpx.Request) -> httpx.Response:
+        client, slots = self._connection()
+        start = time.monotonic()
+
+        # Mirrors the pool size, so time spent here is time spent waiting for a free connection
+        async with slots:
+            waited = time.monotonic() - start
+            self.stats.requests += 1
+            if waited > POOL_WAIT_THRESHOLD:
+                self.stats.pool_waits += 1
+                self.stats.pool_wait_seconds += waited
+                self.stats.max_pool_wait = max(self.stats.max_pool_wait, waited)
+
+            return await client.send(request)
+
+
+class ClientRegistry:
+    def __init__(self, upstreams: list[Upstream], fallback: Upstream) -> None:
+        self.upstreams = upstreams
+        self.fallback = fallback
+        self._by_host = {host: upstream for upstream in upstreams for host in upstream.hosts}
+
+    def __iter__(self) -> Iterator[Upstream]:
+        yield from self.upstreams
+        yield self.fallback
+
+    def for_url(self, url: httpx.URL) -> Upstream:
+        return self._by_host.get(url.host, self.fallback)
+
+    def open(self) -> None:
+        for upstream in self:
+            upstream.open()
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(upstream.aclose() for upstream in self))
+
+    def reset(self) -> None:
+        for upstream in self:
+            upstream.reset()
+
+
+def discord_http2() -> bool:
+    if not settings.DISCORD_HTTP2:
+        return False
+    if find_spec("h2") is None:
+        gunicorn_logger.warning("DISCORD_HTTP2 is set but the h2 package isn't installed, using HTTP/1.1")
+        return False
+    return True
+
+
+registry = ClientRegistry(
+    [
+        Upstream(
+            "discord",
+            (DISCORD_HOST,),
+            httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=60),
+            httpx.Timeout(10, connect=5),
+            http2=discord_http2(),
+        ),
+        Upstream(
+            "archub",
+            (httpx.URL(ARCHUB_API).host,),
+            httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30),
+            httpx.Timeout(10, connect=5),
+        ),
+        Upstream(
+            "a3sync",
+            (httpx.URL(REPO_URL).host,),
+            httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=30),
+            httpx.Timeout(15, connect=5),
+        ),
+        Upstream(
+            "github",
+            ("api.github.com",),
+            httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=30),
+            httpx.Timeout(10, connect=5),
+        ),
+        Upstream(
+            "steam",
+            (httpx.URL(STEAM_URL).host, "steamcommunity.com"),
+            httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=30),
+            httpx.Timeout(30, connect=10),
+        ),
+    ],
+    fallback=Upstream(
+        "other",
+        (),
+        httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=5),
+        httpx.Timeout(10, connect=5),
+    ),
+)
@@ -0,0 +1,115 @@
+import json
+from typing import Any
+
+from starlette.responses import Response
+
+from SvenBot.models import Interaction, InteractionResponse, InteractionResponseType, InteractionType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+def loads(data: bytes) -> Any:  # noqa: ANN401
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:  # noqa: ANN401
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+class FastUser:
+    __slots__ = ("id", "username")
+
+    def __init__(self, payload: dict) -> None:
+        self.id: str = payload["id"]
+        self.username: str = payload["username"]
+
+
+class FastMember:
+    __slots__ = ("nick", "roles", "user")
+
+    def __init__(self, payload: dict) -> None:
+        user = payload.get("user")
+        self.user = FastUser(user) if user is not None else None
+        self.nick: str | None = payload.get("nick")
+        self.roles: list[str] = payload.get("roles", [])
+
+
+class FastOption:
+    __slots__ = ("focused", "name", "options", "type", "value")
+
+    def __init__(self, payload: dict) -> None:
+        self.name: str = payload["name"]
+        self.type: int = payload["type"]
+        self.value = payload.get("value")
+        self.options = fast_options(payload.get("options"))
+        self.focused: bool | None = payload.get("focused")
+
+
+def fast_options(payload: list[dict] | None) -> list[FastOption] | None:
+    return [FastOption(option) for option in payload] if payload is not None else None
+
+
+class FastCommand:
+    __slots__ = ("id", "name", "options")
+
+    def __init__(self, payload: dict) -> None:
+        self.id: str = payload["id"]
+        self.name: str = payload["name"]
+        self.options = fast_options(payload.get("options"))
+
+
+class FastInteraction:
+    """The parts of an interaction the commands read, taken straight from the decoded payload."""
+
+    __slots__ = ("application_id", "data", "guild_id", "id", "member", "token", "type")
+
+    def __init__(self, payload: dict) -> None:
+        self.id: str = payload["id"]
+        self.application_id: str = payload["application_id"]
+        self.type = InteractionType(payload["type"])
+        self.token: str = payload["token"]
+        self.guild_id: str | None = payload.get("guild_id")
+
+        data = payload.get("data")
+        self.data = FastCommand(data) if data is not None else None
+        member = payload.get("member")
+        self.member = FastMember(member) if member is not None else None
+
+
+def decode_interaction(body: bytes) -> FastInteraction | Interaction:
+    """Decode an interaction without pydantic, falling back to it for anything the fast path doesn't expect.
+
+    The fallback raises pydantic's ValidationError for payloads that really are invalid.
+    """
+    try:
+        return FastInteraction(loads(body))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return Interaction.parse_raw(body)
+
+
+def json_response(content: bytes) -> Response:
+    return Response(content=content, media_type="application/json")
+
+
+PONG = dumps({"type": InteractionResponseType.PONG})
+
+
+# What a plain message reply sets, which is simple enough to encode without pydantic
+PLAIN_REPLY_FIELDS = frozenset(("content", "allowed_mentions", "flags"))
+
+
+def encode_response(response: InteractionResponse) -> Response:
+    """Encode a reply, building plain messages by hand rather than walking every field with .dict()."""
+    data = response.data
+    if data is None:
+        return json_response(dumps({"type": response.type}))
+    if data.__fields_set__ <= PLAIN_REPLY_FIELDS:
+        return json_response(
+            dumps({"type": response.type, "data": {name: getattr(data, name) for name in data.__fields_set__}})
+        )
+    return json_response(dumps(response.dict()))
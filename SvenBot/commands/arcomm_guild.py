@@ -6,6 +6,7 @@ from SvenBot.commands.command_models import (
     d20,
     maps,
     members,
+    modchanges,
     myroles,
     optime,
     removerole,
@@ -33,6 +34,7 @@ commands = [
     renamerole,
     maps,
     members,
+    modchanges,
     myroles,
     optime,
     role,
@@ -1,20 +1,16 @@
 from pydantic import BaseModel
 
-from SvenBot.models import OptionType
+from SvenBot.models import Choice, OptionType
 
 MANAGE_GUILD_PERMISSION = str(1 << 5)
 
 
-class Choice(BaseModel):
-    name: str
-    value: str
-
-
 class OptionDefinition(BaseModel):
     name: str
     description: str
     type: OptionType
     required: bool = True
+    autocomplete: bool = False
 
 
 class CommandDefinition(BaseModel):
@@ -126,6 +122,25 @@ members = CommandDefinition(
     ],
 )
 
+modchanges = CommandDefinition(
+    name="modchanges",
+    description="Get the mod changes made to the A3Sync repo",
+    options=[
+        OptionDefinition(
+            name="since",
+            description="List changes after this revision (defaults to the latest revision only)",
+            type=OptionType.INTEGER,
+            required=False,
+        ),
+        OptionDefinition(
+            name="until",
+            description="List changes up to this revision",
+            type=OptionType.INTEGER,
+            required=False,
+        ),
+    ],
+)
+
 myroles = CommandDefinition(
     name="myroles",
     description="Get a list of roles you're in",
@@ -151,7 +166,8 @@ role = CommandDefinition(
         OptionDefinition(
             name="role",
             description="Role",
-            type=OptionType.ROLE,
+            type=OptionType.STRING,
+            autocomplete=True,
         ),
     ],
 )
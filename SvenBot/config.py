@@ -10,6 +10,7 @@ class Settings(BaseSettings):
     CLIENT_ID: str
     PUBLIC_KEY: str
     GITHUB_TOKEN: str
+    SLACK_SIGNING_SECRET: str
 
     STEAM_MODLIST: int
 
@@ -22,23 +23,76 @@ class Settings(BaseSettings):
     MEMBER_ROLE: int
     RECRUIT_ROLE: int
 
+    ROLE_CACHE_TTL: float = 60
+    ROLE_CACHE_STALE_TTL: float = 600
+    ROLE_CACHE_SIZE: int = 16
+    MEMBER_CACHE_TTL: float = 300
+    MEMBER_CACHE_STALE_TTL: float = 3600
+    MEMBER_CACHE_SIZE: int = 4
+    ARCHUB_CACHE_TTL: float = 60
+    ARCHUB_CACHE_SIZE: int = 16
+    # "sqlite" shares the role, member and ArcHub caches between workers through the database when there's more than
+    # one, "memory" keeps them per worker
+    CACHE_BACKEND: str = "sqlite"
+
+    DISCORD_HTTP2: bool = False
+    DISCORD_GLOBAL_LIMIT: int = 50
+    # The number of gunicorn workers, which share Discord's global rate limit between them
+    WEB_CONCURRENCY: int = 1
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 0.5
+    RETRY_MAX_DELAY: float = 5.0
+    RETRY_MAX_ELAPSED: float = 15.0
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_TIMEOUT: float = 30.0
+
+    RESPONSE_BUDGET: float = 2.0
+    INTERACTION_MAX_BODY_SIZE: int = 262144
+    INTERACTION_TIMESTAMP_WINDOW: float = 300
+    SHUTDOWN_GRACE: float = 10.0
+
+    STATE_DIR: str = "."
+    DATABASE_URL: str = "sqlite:///svenbot.db"
+    STEAM_COLLECTION_REFRESH: float = 21600
+    STEAM_DETAILS_CHUNK_SIZE: int = 50
+
+    # Calendar event patterns mapped to the roles to ping, the channel and the embed colour, e.g.
+    # EVENT_PINGS='{"main": [[1, 2], 3, 10038562]}'
+    EVENT_PINGS: dict[str, tuple[list[int], int, int | None]] | None = None
+    SLACK_EVENT_RETENTION: float = 86400
+    SLACK_REPLAY_WINDOW: float = 300
+
+    OUTBOX_MAX_ATTEMPTS: int = 8
+    OUTBOX_RETRY_DELAY: float = 5.0
+    OUTBOX_MAX_RETRY_DELAY: float = 600.0
+    OUTBOX_POLL_INTERVAL: float = 5.0
+    OUTBOX_FAILED_RETENTION: float = 604800
+    LEADER_ELECTION_INTERVAL: float = 15.0
+    LOOP_LAG_INTERVAL: float = 1.0
+    # /metrics is only served, to "Authorization: Bearer <token>", when this is set
+    METRICS_TOKEN: str | None = None
+    METRICS_PUBLISH_INTERVAL: float = 15.0
+
     class Config:
         env_file = ".env"
 
 
 settings = Settings()
 
-EVENT_PINGS = {
-    "main": [[settings.MEMBER_ROLE, settings.RECRUIT_ROLE], settings.OP_CHANNEL, 0x992D22],
-    "recruit": [[settings.RECRUIT_ROLE], settings.OP_CHANNEL, 0x1F8B4C],
+EVENT_PINGS = settings.EVENT_PINGS or {
+    "main": ([settings.MEMBER_ROLE, settings.RECRUIT_ROLE], settings.OP_CHANNEL, 0x992D22),
+    "recruit": ([settings.RECRUIT_ROLE], settings.OP_CHANNEL, 0x1F8B4C),
 }
 
 BASE_ARCHUB_URL = "https://arcomm.co.uk"
 HUB_URL = f"{BASE_ARCHUB_URL}/hub"
 ARCHUB_API = f"{BASE_ARCHUB_URL}/api/v1"
-APP_URL = f"https://discord.com/api/v8/applications/{settings.CLIENT_ID}"
-CHANNELS_URL = "https://discord.com/api/v8/channels"
-GUILD_URL = "https://discord.com/api/v8/guilds"
+DISCORD_HOST = "discord.com"
+DISCORD_API = f"https://{DISCORD_HOST}/api/v8"
+APP_URL = f"{DISCORD_API}/applications/{settings.CLIENT_ID}"
+CHANNELS_URL = f"{DISCORD_API}/channels"
+GUILD_URL = f"{DISCORD_API}/guilds"
+WEBHOOKS_URL = f"{DISCORD_API}/webhooks"
 REPO_URL = "https://events.arcomm.co.uk/api"
 STEAM_URL = "https://api.steampowered.com/ISteamRemoteStorage"
 
@@ -0,0 +1,134 @@
+from typing import Any
+
+from sqlalchemy import JSON, Column, Float, Integer, String, Text, create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from SvenBot.config import settings
+
+Base: Any = declarative_base()
+
+IN_MEMORY_URLS = frozenset(("sqlite://", "sqlite:///:memory:"))
+
+
+class SteamMod(Base):
+    __tablename__ = "steam_mods"
+
+    publishedfileid = Column(String, primary_key=True)
+    title = Column(String, nullable=False)
+    time_updated = Column(Integer, nullable=False)
+    changelog = Column(Text)
+
+
+class SteamCollection(Base):
+    __tablename__ = "steam_collections"
+
+    collection_id = Column(String, primary_key=True)
+    mods = Column(JSON, nullable=False)
+    refreshed_at = Column(Float, nullable=False)
+
+
+class A3SyncRevision(Base):
+    __tablename__ = "a3sync_revisions"
+
+    revision = Column(Integer, primary_key=True)
+    new_addons = Column(JSON, nullable=False)
+    deleted_addons = Column(JSON, nullable=False)
+    updated_addons = Column(JSON, nullable=False)
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    channel_id = Column(Integer, nullable=False, index=True)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False)
+    last_error = Column(Text)
+
+
+class SlackEventReceipt(Base):
+    __tablename__ = "slack_event_receipts"
+
+    event_id = Column(String, primary_key=True)
+    received_at = Column(Float, nullable=False, index=True)
+
+
+class CacheRecord(Base):
+    __tablename__ = "cache_records"
+
+    key = Column(String, primary_key=True)
+    value = Column(JSON)
+    stored_at = Column(Float, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class MetricsSnapshot(Base):
+    __tablename__ = "metrics_snapshots"
+
+    worker_id = Column(String, primary_key=True)
+    families = Column(JSON, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+
+def enable_wal(connection, _record) -> None:  # noqa: ANN001
+    # Every worker opens the same file, and WAL lets their reads carry on while one of them writes
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class Database:
+    """A lazily created engine, with the schema created the first time it's opened.
+
+    Sessions are blocking, so callers on the event loop should run them via asyncio.to_thread.
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._engine: Engine | None = None
+        self._sessions: sessionmaker | None = None
+
+    @property
+    def engine(self) -> Engine:
+        engine, _ = self._connection()
+        return engine
+
+    def open(self) -> None:
+        self._connection()
+
+    def _connection(self) -> tuple[Engine, sessionmaker]:
+        if self._engine is None or self._sessions is None:
+            kwargs = {}
+            if self.url.startswith("sqlite"):
+                # Sessions run on worker threads, and an in-memory database only exists on its one connection
+                kwargs["connect_args"] = {"check_same_thread": False}
+                if self.url in IN_MEMORY_URLS:
+                    kwargs["poolclass"] = StaticPool
+
+            self._engine = create_engine(self.url, future=True, **kwargs)
+            if self.url.startswith("sqlite") and self.url not in IN_MEMORY_URLS:
+                event.listen(self._engine, "connect", enable_wal)
+            self._sessions = sessionmaker(self._engine, future=True, expire_on_commit=False)
+            Base.metadata.create_all(self._engine)
+        return self._engine, self._sessions
+
+    def close(self) -> None:
+        engine, self._engine, self._sessions = self._engine, None, None
+        if engine is not None:
+            engine.dispose()
+
+    def configure(self, url: str) -> None:
+        self.close()
+        self.url = url
+
+    def session(self) -> Session:
+        _, sessions = self._connection()
+        return sessions()
+
+
+database = Database(settings.DATABASE_URL)
@@ -1,5 +1,8 @@
+import os
+
 bind = "0.0.0.0"
-workers = 1
+# Scheduled tasks run in one elected worker, so more can be opted into with WEB_CONCURRENCY
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
 loglevel = "info"
 worker_class = "uvicorn.workers.UvicornWorker"
 accesslog = "./access.txt"
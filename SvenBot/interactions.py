@@ -1,5 +1,11 @@
+import asyncio
 import logging
 import random
+import time
+from collections.abc import Awaitable, Callable, Coroutine
+from functools import partial
+from itertools import islice
+from typing import Any
 
 import d20
 from fastapi import HTTPException
@@ -13,65 +19,88 @@ from starlette.status import (
     HTTP_501_NOT_IMPLEMENTED,
 )
 
-from SvenBot import utility
+from SvenBot import a3sync, archub, metrics, utility
+from SvenBot.codec import FastInteraction
 from SvenBot.config import (
     ARCHUB_API,
     ARCHUB_HEADERS,
     GITHUB_HEADERS,
     GUILD_URL,
     HUB_URL,
+    settings,
 )
-from SvenBot.models import Interaction, InteractionResponse, InteractionType
+from SvenBot.messages import code_block_chunks, split_text
+from SvenBot.models import Choice, Interaction, InteractionResponse, InteractionType, Option
+from SvenBot.resilience import UpstreamUnavailableError
 
 gunicorn_logger = logging.getLogger("gunicorn.error")
 
 
+async def role_id_from_option(guild_id: str, value: str) -> str | None:
+    """A role picked from the suggestions arrives as its id, one typed out has to match a role's whole name."""
+    index = await utility.get_role_index(guild_id)
+    if value in index.by_id:
+        return value
+
+    # Never a prefix match, which could quietly toggle, or leave, some other role than the one meant
+    role = index.by_name.get(value.lower())
+    return None if role is None else role["id"]
+
+
 async def execute_role(interaction: Interaction) -> str:
     guild_id = interaction.guild_id
     user_id = interaction.member.user.id
-    (role_id,) = interaction.data.options
+    (option,) = interaction.data.options
 
-    if not await utility.validate_role_by_id(guild_id, role_id.value):
-        return f"<@&{role_id.value}> is restricted"
+    role_id = await role_id_from_option(guild_id, option.value)
+    if role_id is None:
+        return f"No role matches '{option.value}'"
 
-    url = f"{GUILD_URL}/{guild_id}/members/{user_id}/roles/{role_id.value}"
+    if not await utility.validate_role_by_id(guild_id, role_id):
+        return f"<@&{role_id}> is restricted"
 
-    if role_id.value in interaction.member.roles:
-        r = await utility.delete([HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN], url)
-        reply = f"You've left <@&{role_id.value}>"
-    else:
+    url = f"{GUILD_URL}/{guild_id}/members/{user_id}/roles/{role_id}"
+
+    joining = role_id not in interaction.member.roles
+    if joining:
         r = await utility.put([HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN], url)
-        reply = f"You've joined <@&{role_id.value}>"
+        reply = f"You've joined <@&{role_id}>"
+    else:
+        r = await utility.delete([HTTP_204_NO_CONTENT, HTTP_403_FORBIDDEN], url)
+        reply = f"You've left <@&{role_id}>"
 
     if r.status_code == HTTP_403_FORBIDDEN:
-        return f"<@&{role_id.value}> is restricted"
+        return f"<@&{role_id}> is restricted"
+
+    await utility.record_role_change(guild_id, user_id, interaction.member.user.username, role_id, joining)
     return reply
 
 
 async def execute_roles(interaction: Interaction) -> str:
-    guild_id = interaction.guild_id
-    roles = await utility.get_roles(guild_id)
+    index = await utility.get_role_index(interaction.guild_id)
+    return "```\n{}\n```".format("\n".join(index.joinable_names()))
 
-    joinable_roles = [role["name"] for role in roles if await utility.validate_role(guild_id, role, roles)]
-    joinable_roles = sorted(joinable_roles)
-    return "```\n{}\n```".format("\n".join(joinable_roles))
 
-
-async def execute_members(interaction: Interaction) -> str:
-    guild_id = interaction.guild_id
+async def execute_members(interaction: Interaction) -> list[str]:
     (role_id,) = interaction.data.options
 
-    url = f"{GUILD_URL}/{guild_id}/members"
+    index = await utility.get_member_index(interaction.guild_id)
+    return code_block_chunks(index.members_with_role(role_id.value))
 
-    r = await utility.get([HTTP_200_OK], url, params={"limit": 200})
-    members = r.json()
-    reply = ""
 
-    for member in members:
-        if role_id.value in member["roles"]:
-            reply += member["user"]["username"] + "\n"
+async def execute_modchanges(interaction: Interaction) -> str | list[str]:
+    options = {option.name: option.value for option in interaction.data.options or []}
+    since, until = options.get("since"), options.get("until")
+
+    revisions = await a3sync.get_revisions(since, until)
+    if not revisions:
+        return "No mod changes have been recorded" if since is None else f"No mod changes since revision {since}"
 
-    return f"```\n{reply}```"
+    lines = []
+    for revision in revisions:
+        lines.extend(a3sync.revision_lines(revision))
+        lines.append("")
+    return code_block_chunks(lines[:-1], language="md")
 
 
 async def execute_myroles(interaction: Interaction) -> str:
@@ -110,6 +139,7 @@ async def execute_addrole(interaction: Interaction) -> str:
 
     url = f"{GUILD_URL}/{guild_id}/roles"
     r = await utility.post([HTTP_200_OK], url, json={"name": name.value, "mentionable": True})
+    await utility.invalidate_roles(guild_id)
     role_id = r.json()["id"]
 
     return f"<@&{role_id}> added"
@@ -123,6 +153,7 @@ async def execute_removerole(interaction: Interaction) -> str:
         url = f"{GUILD_URL}/{guild_id}/roles/{role_id.value}"
 
         await utility.delete([HTTP_204_NO_CONTENT], url)
+        await utility.invalidate_roles(guild_id)
         return "Role deleted"
 
     return "Role is restricted"
@@ -163,31 +194,18 @@ async def execute_renamerole(interaction: Interaction) -> str:
 
     url = f"{GUILD_URL}/{guild_id}/roles/{role_id.value}"
     await utility.patch([HTTP_200_OK], url, json={"name": new_name.value})
+    await utility.invalidate_roles(guild_id)
 
     return f"<@&{role_id.value}> was renamed"
 
 
 async def execute_maps(interaction: Interaction) -> str:  # noqa: ARG001
-    url = f"{ARCHUB_API}/maps"
-    r = await utility.get([HTTP_200_OK], url, headers=ARCHUB_HEADERS)
-    maps = r.json()
-
-    out_string = "File name [Display name]\n=========================\n"
-    for _map in maps:
-        out_string += (
-            f"{_map['class_name']}\n"
-            if _map["class_name"] == _map["display_name"]
-            else f"{_map['class_name']} [{_map['display_name']}]\n"
-        )
-
-    return f"```ini\n{out_string}```"
+    return await archub.get_maps_text()
 
 
 async def execute_renamemap(interaction: Interaction) -> str:
     old_name, new_name = interaction.data.options
-
-    url = f"{ARCHUB_API}/maps?old_name={old_name.value}&new_name={new_name.value}"
-    await utility.patch([HTTP_204_NO_CONTENT], url, headers=ARCHUB_HEADERS)
+    await archub.rename_map(old_name.value, new_name.value)
 
     return f"`{old_name.value}` was renamed to `{new_name.value}`"
 
@@ -209,12 +227,14 @@ async def execute_ping(interaction: Interaction) -> str:  # noqa: ARG001
     return "Pong!"
 
 
-execute_map = {
+# Handlers are written against Interaction, but are just as happily given the FastInteraction standing in for one
+execute_map: dict[str, Callable[[Any], Coroutine[Any, Any, str | list[str]]]] = {
     "addrole": execute_addrole,
     "cointoss": execute_cointoss,
     "d20": execute_d20,
     "maps": execute_maps,
     "members": execute_members,
+    "modchanges": execute_modchanges,
     "myroles": execute_myroles,
     "optime": execute_optime,
     "ping": execute_ping,
@@ -229,8 +249,62 @@ execute_map = {
 
 ephemeral = ["myroles"]
 
+# Discord shows at most this many autocomplete choices
+AUTOCOMPLETE_LIMIT = 25
+
+# Seconds to wait before deferring; anything not listed gets settings.RESPONSE_BUDGET
+response_budgets = {
+    "maps": 1.5,
+    "members": 1.0,
+    "renamerole": 1.5,
+    "ticket": 1.5,
+}
+
+
+async def autocomplete_joinable_role(interaction: Interaction, query: str) -> list[Choice]:
+    index = await utility.get_role_index(interaction.guild_id)
+    matches = index.prefix_matches(query, limit=len(index.roles))
+    joinable = (role for role in matches if index.is_valid(role))
+    return [Choice(name=role["name"], value=role["id"]) for role in islice(joinable, AUTOCOMPLETE_LIMIT)]
+
+
+autocomplete_map: dict[str, Callable[[Any, str], Awaitable[list[Choice]]]] = {
+    "role": autocomplete_joinable_role,
+}
+
+
+def focused_option(options: list[Option] | None) -> Option | None:
+    for option in options or []:
+        if option.focused:
+            return option
+
+        nested = focused_option(option.options)
+        if nested is not None:
+            return nested
+    return None
+
+
+async def handle_autocomplete(interaction: Interaction | FastInteraction) -> InteractionResponse:
+    command = interaction.data.name
+    if command not in autocomplete_map:
+        raise HTTPException(status_code=HTTP_501_NOT_IMPLEMENTED, detail=f"'{command}' has no autocomplete")
+
+    option = focused_option(interaction.data.options)
+    query = "" if option is None or option.value is None else str(option.value)
+
+    try:
+        choices = await autocomplete_map[command](interaction, query)
+    except Exception as e:
+        gunicorn_logger.error(f"Error autocompleting '{command}':\n{e})")
+        choices = []
+
+    return utility.autocomplete_reply(choices)
+
+
+async def handle_interaction(interaction: Interaction | FastInteraction) -> InteractionResponse:
+    if interaction.type == InteractionType.APPLICATION_COMMAND_AUTOCOMPLETE:
+        return await handle_autocomplete(interaction)
 
-async def handle_interaction(interaction: Interaction) -> InteractionResponse:
     if interaction.type != InteractionType.APPLICATION_COMMAND:
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Not an application command")
 
@@ -241,9 +315,75 @@ async def handle_interaction(interaction: Interaction) -> InteractionResponse:
     try:
         gunicorn_logger.info(f"'{interaction.member.user.username}' executing '{command}'")
 
-        reply = await execute_map[command](interaction)
-        return utility.immediate_reply(reply, ephemeral=command in ephemeral)
+        execution = asyncio.create_task(execute_map[command](interaction))
+        execution.add_done_callback(partial(record_command, command, time.monotonic()))
+        done, _ = await asyncio.wait({execution}, timeout=response_budgets.get(command, settings.RESPONSE_BUDGET))
+        if not done:
+            gunicorn_logger.info(f"Deferring '{command}'")
+            utility.create_background_task(complete_deferred(interaction, command, execution))
+            return utility.deferred_reply(ephemeral=command in ephemeral)
+
+        first, *rest = as_messages(execution.result())
+        if rest:
+            utility.create_background_task(send_followups(interaction, command, rest))
+        return utility.immediate_reply(first, ephemeral=command in ephemeral)
+
+    except UpstreamUnavailableError as e:
+        gunicorn_logger.warning(f"Not executing '{command}': {e}")
+        return utility.immediate_reply(unavailable_reply(e), ephemeral=True)
 
     except Exception as e:
         gunicorn_logger.error(f"Error executing '{command}':\n{e})")
         raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error executing '{command}'") from e
+
+
+def record_command(command: str, start: float, execution: asyncio.Task) -> None:
+    if execution.cancelled():
+        outcome = "cancelled"
+    elif isinstance(execution.exception(), UpstreamUnavailableError):
+        outcome = "unavailable"
+    elif execution.exception() is not None:
+        outcome = "error"
+    else:
+        outcome = "ok"
+    metrics.command_duration.observe(time.monotonic() - start, command, outcome)
+
+
+def unavailable_reply(error: UpstreamUnavailableError) -> str:
+    return f"Can't reach {error.upstream} right now, please try again in a minute"
+
+
+def as_messages(reply: str | list[str]) -> list[str]:
+    return split_text(reply) if isinstance(reply, str) else reply
+
+
+async def send_followups(interaction: Interaction | FastInteraction, command: str, messages: list[str]) -> None:
+    try:
+        for message in messages:
+            await utility.send_followup(
+                interaction.application_id,
+                interaction.token,
+                message,
+                ephemeral=command in ephemeral,
+            )
+    except Exception as e:
+        gunicorn_logger.error(f"Error sending follow-up for '{command}':\n{e})")
+
+
+async def complete_deferred(interaction: Interaction | FastInteraction, command: str, execution: asyncio.Task) -> None:
+    try:
+        first, *rest = as_messages(await execution)
+    except UpstreamUnavailableError as e:
+        gunicorn_logger.warning(f"Not executing deferred '{command}': {e}")
+        first, rest = unavailable_reply(e), []
+    except Exception as e:
+        gunicorn_logger.error(f"Error executing deferred '{command}':\n{e})")
+        first, rest = f"Error executing '{command}'", []
+
+    try:
+        await utility.edit_original_response(interaction.application_id, interaction.token, first)
+    except Exception as e:
+        gunicorn_logger.error(f"Error sending deferred reply for '{command}':\n{e})")
+        return
+
+    await send_followups(interaction, command, rest)
@@ -0,0 +1,81 @@
+import asyncio
+import fcntl
+import logging
+import os
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from pathlib import Path
+from typing import IO
+
+from SvenBot.config import settings
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+
+class Leadership:
+    """Elects one worker to run the scheduled tasks and the outbox, by holding an exclusive lock on a file.
+
+    The kernel drops the lock when the leader's process exits however it dies, and the other workers keep trying
+    to take it, so one of them steps up within an election interval.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._file: IO[str] | None = None
+        self._elector: asyncio.Task | None = None
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.STATE_DIR) / self.name
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        if self._file is not None:
+            return True
+
+        path = self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file = path.open("a+")
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+
+        # Only informational, the lock is what matters
+        file.truncate(0)
+        file.write(f"{os.getpid()}\n")
+        file.flush()
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        file, self._file = self._file, None
+        if file is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            file.close()
+
+    def start(self, on_elected: Callable[[], Awaitable[None]]) -> None:
+        if self._elector is None:
+            self._elector = asyncio.create_task(self._run(on_elected))
+
+    async def stop(self) -> None:
+        elector, self._elector = self._elector, None
+        if elector is not None:
+            elector.cancel()
+            with suppress(asyncio.CancelledError):
+                await elector
+        self.release()
+
+    async def _run(self, on_elected: Callable[[], Awaitable[None]]) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(settings.LEADER_ELECTION_INTERVAL)
+
+        gunicorn_logger.info(f"Worker {os.getpid()} elected leader")
+        await on_elected()
+
+
+leadership = Leadership("leader.lock")
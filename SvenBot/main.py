@@ -1,157 +1,239 @@
-import json
+import hashlib
+import hmac
 import logging
-import re
 import sys
-from datetime import datetime
+import time
 from pathlib import Path
 
 import uvicorn
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.params import Depends
+from nacl.exceptions import BadSignatureError
 from nacl.signing import VerifyKey
-from starlette.status import HTTP_401_UNAUTHORIZED
+from pydantic import ValidationError
+from starlette.status import (
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
 
 ROOT_DIR = Path(__file__).parent.parent
 sys.path.append(str(ROOT_DIR))
 
-from SvenBot.config import BASE_ARCHUB_URL, EVENT_PINGS, HUB_URL, settings
+from SvenBot import clients, codec, metrics
+from SvenBot import slack as slack_events
+from SvenBot.config import settings
+from SvenBot.database import database
 from SvenBot.interactions import handle_interaction
+from SvenBot.leader import leadership
+from SvenBot.metrics import loop_lag_monitor, metrics_publisher, timed_task
 from SvenBot.models import (
-    Embed,
-    EmbedField,
-    EmbedThumbnail,
-    Interaction,
     InteractionResponse,
-    InteractionResponseType,
     InteractionType,
     SlackNotification,
     SlackNotificationType,
 )
-from SvenBot.tasks import REVISION_PATH, TIMESTAMP_PATH, a3sync_task, recruit_task, steam_task
-from SvenBot.utility import get_operation_missions, mission_colour_from_mode, send_message
+from SvenBot.outbox import outbox
+from SvenBot.tasks import a3sync_task, recruit_task, steam_task
+from SvenBot.utility import create_background_task, drain_background_tasks
 
 gunicorn_logger = logging.getLogger("gunicorn.error")
 
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
 
 class ValidDiscordRequest:
+    """Checks Discord's Ed25519 signature over the raw body, before anything in the request is parsed.
+
+    The verify key is built once, and oversized bodies and stale timestamps are turned away before verifying.
+    """
+
+    def __init__(self, public_key: str, max_body_size: int, timestamp_window: float) -> None:
+        self.max_body_size = max_body_size
+        self.timestamp_window = timestamp_window
+        try:
+            self.verify_key: VerifyKey | None = VerifyKey(bytes.fromhex(public_key))
+        except Exception as e:
+            gunicorn_logger.error(f"Invalid PUBLIC_KEY, rejecting every interaction:\n{e}")
+            self.verify_key = None
+
     async def __call__(self, request: Request) -> bool:
         signature = request.headers.get("X-Signature-Ed25519")
         timestamp = request.headers.get("X-Signature-Timestamp")
+
+        if signature is None or timestamp is None or not timestamp.isdigit():
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Bad request signature")
+        if abs(time.time() - int(timestamp)) > self.timestamp_window:
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Stale request timestamp")
+
+        content_length = request.headers.get("Content-Length", "0")
+        if not content_length.isdigit() or int(content_length) > self.max_body_size:
+            raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Request body too large")
+
         body = await request.body()
+        if len(body) > self.max_body_size:
+            raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Request body too large")
 
-        if signature is None or timestamp is None or not verify_key(body, signature, timestamp):
+        if not self.verify(body, signature, timestamp):
             raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Bad request signature")
 
         return True
 
+    def verify(self, body: bytes, signature: str, timestamp: str) -> bool:
+        if self.verify_key is None:
+            return False
+
+        try:
+            self.verify_key.verify(timestamp.encode() + body, bytes.fromhex(signature))
+            return True
+        except (BadSignatureError, ValueError) as e:
+            gunicorn_logger.info(f"Rejected interaction: {e}")
+            return False
+
+
+class ValidSlackRequest:
+    """Checks Slack's signature over the raw body, before anything in the request is parsed.
 
-def verify_key(body: bytes, signature: str, timestamp: str) -> bool:
-    message = timestamp.encode() + body
+    The HMAC is keyed once up front and copied per request, and stale timestamps are turned away before it's used.
+    """
+
+    def __init__(self, signing_secret: str, replay_window: float) -> None:
+        self.replay_window = replay_window
+        self._mac = hmac.new(signing_secret.encode(), digestmod=hashlib.sha256)
+
+    async def __call__(self, request: Request) -> bool:
+        signature = request.headers.get("X-Slack-Signature")
+        timestamp = request.headers.get("X-Slack-Request-Timestamp")
+
+        if signature is None or timestamp is None or not timestamp.isdigit():
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Bad request signature")
+        if abs(time.time() - int(timestamp)) > self.replay_window:
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Stale request timestamp")
+
+        mac = self._mac.copy()
+        mac.update(b"v0:" + timestamp.encode() + b":" + await request.body())
+        if not hmac.compare_digest(f"v0={mac.hexdigest()}", signature):
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Bad request signature")
 
-    try:
-        VerifyKey(bytes.fromhex(settings.PUBLIC_KEY)).verify(message, bytes.fromhex(signature))
         return True
-    except Exception as e:
-        gunicorn_logger.error(e)
-        return False
 
 
-def app() -> FastAPI:
+def create_app() -> FastAPI:
     fast_app = FastAPI()
 
     @fast_app.get("/abc/")
     def hello_world() -> dict[str, str]:
         return {"message": "Hello, World!"}
 
-    @fast_app.post("/interaction/", response_model=InteractionResponse)
-    async def interact(
-        interaction: Interaction = Body(...),
-        valid: bool = Depends(ValidDiscordRequest()),  # noqa: ARG001
-    ) -> InteractionResponse:
-        if interaction.type == InteractionType.PING:
-            return InteractionResponse(type=InteractionResponseType.PONG)
+    @fast_app.get("/metrics")
+    async def get_metrics(authorization: str | None = Header(None)) -> Response:
+        if settings.METRICS_TOKEN is None:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+
+        expected = f"Bearer {settings.METRICS_TOKEN}".encode()
+        if authorization is None or not hmac.compare_digest(authorization.encode(), expected):
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+
+        content = await metrics.render_all_workers(settings.METRICS_PUBLISH_INTERVAL)
+        return Response(content=content, media_type=METRICS_CONTENT_TYPE)
+
+    @fast_app.post(
+        "/interaction/",
+        response_model=InteractionResponse,
+        dependencies=[
+            Depends(
+                ValidDiscordRequest(
+                    settings.PUBLIC_KEY,
+                    settings.INTERACTION_MAX_BODY_SIZE,
+                    settings.INTERACTION_TIMESTAMP_WINDOW,
+                ),
+            ),
+        ],
+    )
+    async def interact(request: Request) -> Response:
+        # Read from the raw body the signature was checked against, so FastAPI doesn't parse it first
+        try:
+            interaction = codec.decode_interaction(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors()) from e
 
-        return await handle_interaction(interaction)
+        if interaction.type == InteractionType.PING:
+            return codec.json_response(codec.PONG)
+
+        # Encoded directly, skipping FastAPI's re-validation of the reply against response_model
+        return codec.encode_response(await handle_interaction(interaction))
+
+    @fast_app.post(
+        "/slack/",
+        dependencies=[Depends(ValidSlackRequest(settings.SLACK_SIGNING_SECRET, settings.SLACK_REPLAY_WINDOW))],
+    )
+    async def slack(
+        request: Request,
+        retry_num: str | None = Header(None, alias="X-Slack-Retry-Num"),
+    ) -> dict[str, str | None] | None:
+        # Parsed here rather than as a Body parameter so that unsigned requests are never parsed at all
+        try:
+            notification = SlackNotification.parse_raw(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors()) from e
 
-    @fast_app.post("/slack/")
-    async def slack(notification: SlackNotification = Body(...)) -> None:
         gunicorn_logger.error(f"Calendar event:\n{notification}")
         if notification.type == SlackNotificationType.VERIFICATION:
             return {"challenge": notification.challenge}
 
-        cal = notification.event.attachments[0]
-        matches = re.match(r"<!date\^(\d+)\^\{\w+\}.*? - <!date\^(\d+)\^\{\w+}.*?<.*?\|(.*)>", cal.title)
-
-        if matches:
-            event, pings, channel, color = None, None, settings.OP_CHANNEL, None
-            for e, pcc in EVENT_PINGS.items():
-                if re.search(e, cal.title.lower()):
-                    pings = " ".join(f"<@&{ping}>" for ping in pcc[0])
-                    event, channel, color = e, pcc[1], pcc[2]
-                    break
-
-            start_time, end_time, title = matches.groups()
-            fields = [
-                EmbedField(name="Start", value=f"<t:{start_time}:t>", inline=True),
-                EmbedField(name="End", value=f"<t:{end_time}:t>", inline=True),
-            ]
-            embeds = [
-                Embed(title=title, description=f"Starting <t:{start_time}:R>", fields=fields, color=color),
-            ]
-
-            if event == "main":
-                for mission in await get_operation_missions():
-                    link = f"{HUB_URL}/missions/{mission['id']}"
-                    maker_string = "Maintained" if mission["hasMaintainer"] else "Made"
-
-                    thumbnail: EmbedThumbnail | None
-                    if " " in mission["thumbnail"]:
-                        print("Skipping thumbnail!")
-                        thumbnail = None
-                    else:
-                        thumbnail = EmbedThumbnail(url=f"{BASE_ARCHUB_URL}{mission['thumbnail']}")
-
-                    embeds.append(
-                        Embed(
-                            title=mission["display_name"],
-                            description=f"{maker_string} by {mission['user']}",
-                            url=link,
-                            thumbnail=thumbnail,
-                            color=mission_colour_from_mode(mission["mode"]),
-                        ),
-                    )
-
-            await send_message(channel, pings, ["roles"], embeds)
+        # Slack wants a response within 3 seconds and retries otherwise, so the announcing happens afterwards
+        if notification.event is not None and await slack_events.accept_event(notification.event_id, retry_num):
+            create_background_task(slack_events.process_event(notification.event))
+        return None
 
     return fast_app
 
 
-app = app()
+app = create_app()
 
 
 @app.on_event("startup")
-def init_scheduler() -> None:
-    try:
-        with REVISION_PATH.open() as f:
-            json.load(f)
-    except Exception:
-        with REVISION_PATH.open("w") as f:
-            json.dump({"revision": 0}, f)
-
-    try:
-        with TIMESTAMP_PATH.open() as f:
-            json.load(f)
-    except Exception:
-        with TIMESTAMP_PATH.open("w") as f:
-            last_month = datetime.utcnow().timestamp() - 2500000
-            json.dump({"last_checked": last_month}, f)
-
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(recruit_task, "cron", day_of_week="mon,wed,fri", hour="17")
-    scheduler.add_job(a3sync_task, "cron", minute="5,25,45")
-    scheduler.add_job(steam_task, "cron", minute="20,50")
+def open_connections() -> None:
+    clients.registry.open()
+    database.open()
+
+
+scheduler = AsyncIOScheduler()
+scheduler.add_job(timed_task(recruit_task), "cron", day_of_week="mon,wed,fri", hour="17")
+scheduler.add_job(timed_task(a3sync_task), "cron", minute="5,25,45")
+scheduler.add_job(timed_task(steam_task), "cron", minute="20,50")
+
+
+async def start_leader_duties() -> None:
     scheduler.start()
+    outbox.start()
+
+
+@app.on_event("startup")
+def start_metrics() -> None:
+    loop_lag_monitor.start(settings.LOOP_LAG_INTERVAL)
+    metrics_publisher.start(settings.METRICS_PUBLISH_INTERVAL)
+
+
+@app.on_event("startup")
+def elect_leader() -> None:
+    # Every worker serves requests, but only one runs the scheduled tasks and sends the outbox
+    leadership.start(start_leader_duties)
+
+
+@app.on_event("shutdown")
+async def finish_background_tasks() -> None:
+    await drain_background_tasks(settings.SHUTDOWN_GRACE)
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    await outbox.stop()
+    await leadership.stop()
+    await loop_lag_monitor.stop()
+    await metrics_publisher.stop()
+    await clients.registry.aclose()
+    database.close()
 
 
 if __name__ == "__main__":
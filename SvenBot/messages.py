@@ -0,0 +1,133 @@
+from SvenBot.models import Embed, ResponseData
+
+MESSAGE_LIMIT = 2000
+EMBED_COUNT_LIMIT = 10
+EMBED_TOTAL_LIMIT = 6000
+
+FENCE = "```"
+# Room kept free in every part for the fence that closes a code block the split falls inside
+CLOSE_RESERVE = len(f"\n{FENCE}")
+
+
+def code_block_chunks(lines: list[str], limit: int = MESSAGE_LIMIT, language: str = "") -> list[str]:
+    """Pack lines into as few code blocks as fit under Discord's message length limit."""
+    opening = f"{FENCE}{language}\n"
+    empty_size = len(f"{opening}{FENCE}")
+    chunks: list[str] = []
+    current: list[str] = []
+    size = empty_size
+
+    for line in lines:
+        if current and size + len(line) + 1 > limit:
+            chunks.append("{}{}{}".format(opening, "".join(current), FENCE))
+            current, size = [], empty_size
+        current.append(f"{line}\n")
+        size += len(line) + 1
+
+    chunks.append("{}{}{}".format(opening, "".join(current), FENCE))
+    return chunks
+
+
+def fence_after(fence: str | None, line: str) -> str | None:
+    """The fence of the code block left open after line, given the one open before it."""
+    if line.count(FENCE) % 2 == 0:
+        return fence
+    if fence is not None:
+        return None
+    return line[line.rindex(FENCE) :].strip()
+
+
+def close_part(part: str, fence: str | None) -> str:
+    if fence is None:
+        return part
+    return f"{part}{FENCE}" if part.endswith("\n") else f"{part}\n{FENCE}"
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Split text into parts under limit, between lines where possible.
+
+    A split inside a code block closes it at the end of one part and reopens it, language included, at the start
+    of the next, so each part renders the same as its share of the original.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    parts: list[str] = []
+    current, has_content, fence = "", False, None
+    # The line that opened the code block current ends in, for as long as nothing has followed it
+    opening = ""
+
+    for line in text.splitlines(keepends=True):
+        # A line that closes its code block doesn't need room for another closing fence after it
+        reserve = CLOSE_RESERVE if fence_after(fence, line) is not None else 0
+        if has_content and len(current) + len(line) + reserve > limit:
+            # A part ending in an opening fence would end in an empty code block, so the fence moves on with the line
+            head = current[: len(current) - len(opening)]
+            if not opening:
+                parts.append(close_part(current, fence))
+                current, has_content = f"{fence}\n" if fence else "", False
+            elif head:
+                parts.append(head)
+                current = opening
+
+        # Lines too long for a part of their own have to be cut mid-line
+        rest = line
+        # The end of a cut line can take the line break before the closing fence, rather than be left on its own
+        spare = 1 if reserve and line.endswith("\n") else 0
+        while len(current) + len(rest) + reserve - spare > limit:
+            room = limit - len(current) - CLOSE_RESERVE
+            parts.append(close_part(current + rest[:room], fence))
+            current, rest = f"{fence}\n" if fence else "", rest[room:]
+
+        current += rest
+        has_content = True
+        opened = fence is None and fence_after(fence, line) is not None
+        opening = line if opened and rest == line else ""
+        fence = fence_after(fence, line)
+
+    if has_content:
+        parts.append(current)
+    return parts
+
+
+def embed_length(embed: Embed) -> int:
+    length = len(embed.title) + len(embed.description)
+    for field in embed.fields or []:
+        length += len(field.name) + len(field.value)
+    return length
+
+
+def group_embeds(embeds: list[Embed]) -> list[list[Embed]]:
+    """Pack embeds, in order, into groups within Discord's per-message embed count and total length limits."""
+    groups: list[list[Embed]] = []
+    current: list[Embed] = []
+    length = 0
+
+    for embed in embeds:
+        size = embed_length(embed)
+        if current and (len(current) == EMBED_COUNT_LIMIT or length + size > EMBED_TOTAL_LIMIT):
+            groups.append(current)
+            current, length = [], 0
+        current.append(embed)
+        length += size
+
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_messages(
+    text: str | None = None,
+    mentions: list[str] = [],
+    embeds: list[Embed] | None = None,
+) -> list[ResponseData]:
+    """The messages needed to post text and embeds, with the first embeds sharing the last part of the text."""
+    texts: list[str | None] = [*split_text(text)] if text else [None]
+    groups: list[list[Embed] | None] = [*group_embeds(embeds)] if embeds else [None]
+
+    contents = texts + [None] * (len(groups) - 1)
+    attached = [None] * (len(texts) - 1) + groups
+    return [
+        ResponseData(content=content, embeds=group, allowed_mentions={"parse": mentions})
+        for content, group in zip(contents, attached, strict=True)
+    ]
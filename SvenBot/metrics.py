@@ -0,0 +1,421 @@
+import asyncio
+import logging
+import time
+import uuid
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from functools import wraps
+from typing import Any
+
+from sqlalchemy import select
+
+from SvenBot.database import MetricsSnapshot, database
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+Labels = tuple[str, ...]
+# Numbers read from elsewhere when metrics are rendered, by label values
+Collector = Callable[[], dict[Labels, float]]
+
+
+def format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{{{}}}".format(",".join(pairs)) if pairs else ""
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int) -> None:
+        # One count per bucket, plus the last for values over every bound
+        self.counts = [0] * (size + 1)
+        self.sum = 0.0
+
+
+class HistogramFamily:
+    """A histogram per combination of label values, counted per bucket and accumulated when rendered."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Labels, buckets: tuple[float, ...]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._histograms: dict[Labels, Histogram] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        histogram = self._histograms.get(labels)
+        if histogram is None:
+            histogram = self._histograms[labels] = Histogram(len(self.buckets))
+        histogram.counts[bisect_left(self.buckets, value)] += 1
+        histogram.sum += value
+
+    def snapshot(self) -> list:
+        return [[list(values), histogram.counts, histogram.sum] for values, histogram in self._histograms.items()]
+
+    def _merged(self, snapshots: list[list]) -> dict[Labels, Histogram]:
+        merged: dict[Labels, Histogram] = {}
+        for snapshot in snapshots:
+            for values, counts, total in snapshot:
+                histogram = merged.setdefault(tuple(values), Histogram(len(self.buckets)))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts, strict=True)]
+                histogram.sum += total
+        return merged
+
+    def merge(self, snapshots: list[list]) -> list:
+        return [
+            [list(values), histogram.counts, histogram.sum] for values, histogram in self._merged(snapshots).items()
+        ]
+
+    def samples(self, snapshots: list[list], live: list[list]) -> list[str]:  # noqa: ARG002
+        lines = []
+        for values, histogram in self._merged(snapshots).items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), histogram.counts, strict=True):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, values)} {histogram.sum}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+    def reset(self) -> None:
+        self._histograms.clear()
+
+
+def value_samples(name: str, labels: Labels, merged: dict[Labels, float]) -> list[str]:
+    return [f"{name}{format_labels(labels, values)} {value}" for values, value in merged.items()]
+
+
+def sum_values(snapshots: list[list]) -> dict[Labels, float]:
+    merged: dict[Labels, float] = {}
+    for snapshot in snapshots:
+        for values, value in snapshot:
+            merged[tuple(values)] = merged.get(tuple(values), 0) + value
+    return merged
+
+
+class CounterFamily:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Labels) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self) -> list:
+        return [[list(values), value] for values, value in self._values.items()]
+
+    def merge(self, snapshots: list[list]) -> list:
+        return [[list(values), value] for values, value in sum_values(snapshots).items()]
+
+    def samples(self, snapshots: list[list], live: list[list]) -> list[str]:  # noqa: ARG002
+        return value_samples(self.name, self.labels, sum_values(snapshots))
+
+    def reset(self) -> None:
+        self._values.clear()
+
+
+class CollectedFamily:
+    """Numbers something else already keeps count of, read only when metrics are rendered.
+
+    Counters are summed over every worker that has ever run, gauges are the highest of the workers still running.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Labels, kind: str, collect: Collector) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.kind = kind
+        self.collect = collect
+
+    def snapshot(self) -> list:
+        return [[list(values), value] for values, value in self.collect().items()]
+
+    def merge(self, snapshots: list[list]) -> list:
+        if self.kind == "counter":
+            return [[list(values), value] for values, value in sum_values(snapshots).items()]
+        # Only running workers count towards gauges, so there's nothing worth keeping
+        return []
+
+    def samples(self, snapshots: list[list], live: list[list]) -> list[str]:
+        if self.kind == "counter":
+            return value_samples(self.name, self.labels, sum_values(snapshots))
+
+        merged: dict[Labels, float] = {}
+        for snapshot in live:
+            for values, value in snapshot:
+                merged[tuple(values)] = max(merged.get(tuple(values), value), value)
+        return value_samples(self.name, self.labels, merged)
+
+    def reset(self) -> None:
+        pass
+
+
+def family_snapshot(family: HistogramFamily | CounterFamily | CollectedFamily) -> list:
+    try:
+        return family.snapshot()
+    except Exception as e:
+        gunicorn_logger.error(f"Error collecting metric '{family.name}':\n{e}")
+        return []
+
+
+class MetricsRegistry:
+    """Metrics kept by this worker, rendered in the Prometheus text format together with every other worker's.
+
+    Recording is a dict lookup and a few increments, so it's cheap enough to stay on everywhere. Each worker
+    publishes a snapshot to the database every so often, and a scrape merges the latest snapshot of every worker.
+    """
+
+    def __init__(self) -> None:
+        self._families: dict[str, HistogramFamily | CounterFamily | CollectedFamily] = {}
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> HistogramFamily:
+        return self._register(HistogramFamily(name, help_text, labels, buckets))
+
+    def counter(self, name: str, help_text: str, labels: Labels = ()) -> CounterFamily:
+        return self._register(CounterFamily(name, help_text, labels))
+
+    def collected(self, name: str, help_text: str, labels: Labels, kind: str, collect: Collector) -> CollectedFamily:
+        return self._register(CollectedFamily(name, help_text, labels, kind, collect))
+
+    def snapshot(self) -> dict[str, list]:
+        return {family.name: family_snapshot(family) for family in self._families.values()}
+
+    def merge(self, snapshots: list[dict[str, list]]) -> dict[str, list]:
+        """A single snapshot adding up several, as if they'd all been taken from one worker."""
+        return {
+            family.name: family.merge([snapshot.get(family.name, []) for snapshot in snapshots])
+            for family in self._families.values()
+        }
+
+    def render(self, snapshots: list[dict[str, list]] | None = None, live: list[dict[str, list]] | None = None) -> str:
+        """Render the merged snapshots of every worker, or of just this one if none are given."""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        if live is None:
+            live = snapshots
+
+        lines = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family.name} {family.help_text}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(
+                family.samples(
+                    [snapshot.get(family.name, []) for snapshot in snapshots],
+                    [snapshot.get(family.name, []) for snapshot in live],
+                ),
+            )
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        for family in self._families.values():
+            family.reset()
+
+    def _register(self, family: Any) -> Any:  # noqa: ANN401
+        if family.name in self._families:
+            raise ValueError(f"Metric '{family.name}' is already registered")
+        self._families[family.name] = family
+        return family
+
+
+registry = MetricsRegistry()
+
+command_duration = registry.histogram(
+    "svenbot_command_duration_seconds",
+    "Time taken to execute a command, whether it was answered at once or deferred",
+    ("command", "outcome"),
+)
+upstream_duration = registry.histogram(
+    "svenbot_upstream_request_duration_seconds",
+    "Time taken by a request to an upstream, including rate limit waits and retries",
+    ("upstream", "method", "status"),
+)
+upstream_retries = registry.counter(
+    "svenbot_upstream_retries_total",
+    "Requests to an upstream retried after a failure",
+    ("upstream",),
+)
+task_duration = registry.histogram(
+    "svenbot_task_duration_seconds",
+    "Time taken by a run of a scheduled task",
+    ("task", "outcome"),
+    TASK_BUCKETS,
+)
+loop_lag = registry.histogram(
+    "svenbot_event_loop_lag_seconds",
+    "How much later than asked for the event loop woke a sleeping task",
+    buckets=LAG_BUCKETS,
+)
+
+
+def timed_task(task: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+    @wraps(task)
+    async def timed() -> Any:  # noqa: ANN401
+        start = time.monotonic()
+        try:
+            result = await task()
+        except Exception:
+            task_duration.observe(time.monotonic() - start, task.__name__, "error")
+            raise
+        task_duration.observe(time.monotonic() - start, task.__name__, "ok")
+        return result
+
+    return timed
+
+
+class LoopLagMonitor:
+    """Sleeps for a fixed interval over and over, recording how late it wakes as a measure of a blocked loop."""
+
+    def __init__(self) -> None:
+        self._task: asyncio.Task | None = None
+
+    def start(self, interval: float) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    async def _run(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            loop_lag.observe(max(loop.time() - start - interval, 0))
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+# Identifies this worker's snapshot, unlike a pid which is reused after a restart
+WORKER_ID = uuid.uuid4().hex
+# Holds what every worker that has gone counted, so there's one row per running worker plus this one
+RETIRED_ID = "retired"
+# Publishing intervals a worker can miss before it's taken to be gone, well past gunicorn's worker timeout
+RETIRE_AFTER_INTERVALS = 20
+
+
+def store_snapshot(worker_id: str, snapshot: dict[str, list], now: float) -> None:
+    with database.session() as session, session.begin():
+        session.merge(MetricsSnapshot(worker_id=worker_id, families=snapshot, updated_at=now))
+
+
+def load_snapshots() -> list[tuple[dict[str, list], float]]:
+    with database.session() as session:
+        query = select(MetricsSnapshot.families, MetricsSnapshot.updated_at)
+        return [(families, updated_at) for families, updated_at in session.execute(query)]
+
+
+def retire_snapshots(worker_ids: list[str] | None, retire_before: float = 0) -> None:
+    """Fold the snapshots of workers that have gone into the retired row, either those given or any gone quiet."""
+    query = select(MetricsSnapshot).where(MetricsSnapshot.worker_id != RETIRED_ID)
+    if worker_ids is None:
+        query = query.where(MetricsSnapshot.updated_at < retire_before)
+    else:
+        query = query.where(MetricsSnapshot.worker_id.in_(worker_ids))
+
+    with database.session() as session, session.begin():
+        gone = session.execute(query).scalars().all()
+        if not gone:
+            return
+
+        retired = session.get(MetricsSnapshot, RETIRED_ID)
+        snapshots = [snapshot.families for snapshot in gone]
+        if retired is not None:
+            snapshots.append(retired.families)
+        # Never counted as live, so it only ever adds to counters and histograms
+        session.merge(MetricsSnapshot(worker_id=RETIRED_ID, families=registry.merge(snapshots), updated_at=0))
+        for snapshot in gone:
+            session.delete(snapshot)
+
+
+def exchange_snapshots(
+    snapshot: dict[str, list],
+    now: float,
+    publish_interval: float,
+) -> list[tuple[dict[str, list], float]]:
+    store_snapshot(WORKER_ID, snapshot, now)
+    retire_snapshots(None, now - RETIRE_AFTER_INTERVALS * publish_interval)
+    return load_snapshots()
+
+
+def retire_worker(worker_id: str, snapshot: dict[str, list]) -> None:
+    store_snapshot(worker_id, snapshot, time.time())
+    retire_snapshots([worker_id])
+
+
+async def render_all_workers(publish_interval: float) -> str:
+    """Metrics merged over every worker, with this one's brought up to date first."""
+    now = time.time()
+    workers = await asyncio.to_thread(exchange_snapshots, registry.snapshot(), now, publish_interval)
+
+    # Workers that have stopped publishing still count towards counters, but not towards gauges
+    live_after = now - 3 * publish_interval
+    return registry.render(
+        [families for families, _ in workers],
+        [families for families, updated_at in workers if updated_at >= live_after],
+    )
+
+
+class MetricsPublisher:
+    """Stores this worker's snapshot every interval, so a scrape served by any worker includes it."""
+
+    def __init__(self) -> None:
+        self._task: asyncio.Task | None = None
+
+    def start(self, interval: float) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            # Keep what this worker counted, counters mustn't go backwards when it exits
+            try:
+                await asyncio.to_thread(retire_worker, WORKER_ID, registry.snapshot())
+            except Exception as e:
+                gunicorn_logger.error(f"Error retiring metrics:\n{e}")
+
+    async def publish(self) -> None:
+        try:
+            await asyncio.to_thread(store_snapshot, WORKER_ID, registry.snapshot(), time.time())
+        except Exception as e:
+            gunicorn_logger.error(f"Error publishing metrics:\n{e}")
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await self.publish()
+            await asyncio.sleep(interval)
+
+
+metrics_publisher = MetricsPublisher()
@@ -8,6 +8,12 @@ class InteractionResponseType(IntEnum):
     PONG = 1
     CHANNEL_MESSAGE_WITH_SOURCE = 4
     DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE = 5
+    APPLICATION_COMMAND_AUTOCOMPLETE_RESULT = 8
+
+
+class Choice(BaseModel):
+    name: str
+    value: str
 
 
 class EmbedThumbnail(BaseModel):
@@ -36,6 +42,7 @@ class ResponseData(BaseModel):
     allowed_mentions: Any
     flags: int | None
     components: Any
+    choices: list[Choice] | None
 
 
 class InteractionResponse(BaseModel):
@@ -47,6 +54,7 @@ class InteractionType(IntEnum):
     PING = 1
     APPLICATION_COMMAND = 2
     MESSAGE_COMPONENT = 3
+    APPLICATION_COMMAND_AUTOCOMPLETE = 4
 
 
 class OptionType(IntEnum):
@@ -97,6 +105,7 @@ class Option(BaseModel):
     type: OptionType
     value: Any
     options: list[Option] | None
+    focused: bool | None
 
 
 Option.update_forward_refs()
@@ -147,4 +156,5 @@ class SlackNotification(BaseModel):
     token: str
     challenge: str | None
     type: SlackNotificationType
+    event_id: str | None
     event: SlackEvent | None
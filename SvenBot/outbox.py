@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from enum import Enum
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.sql import Select
+from starlette.status import HTTP_200_OK
+
+from SvenBot import utility
+from SvenBot.config import CHANNELS_URL, settings
+from SvenBot.database import OutboxMessage, database
+from SvenBot.messages import build_messages
+from SvenBot.models import Embed, ResponseData
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+
+class OutboxStatus(str, Enum):
+    PENDING = "pending"
+    FAILED = "failed"
+
+
+def store_messages(channel_id: int, messages: list[ResponseData], now: float) -> None:
+    with database.session() as session, session.begin():
+        session.add_all(
+            OutboxMessage(
+                channel_id=channel_id,
+                payload=message.dict(),
+                status=OutboxStatus.PENDING.value,
+                attempts=0,
+                next_attempt_at=now,
+            )
+            for message in messages
+        )
+
+
+def channel_heads() -> Select:
+    """The oldest pending message of each channel, the only one of the channel that may be sent next."""
+    return (
+        select(func.min(OutboxMessage.id))
+        .where(OutboxMessage.status == OutboxStatus.PENDING.value)
+        .group_by(OutboxMessage.channel_id)
+    )
+
+
+def due_messages(now: float) -> list[OutboxMessage]:
+    query = (
+        select(OutboxMessage)
+        .where(OutboxMessage.id.in_(channel_heads()), OutboxMessage.next_attempt_at <= now)
+        .order_by(OutboxMessage.id)
+    )
+    with database.session() as session:
+        return list(session.scalars(query))
+
+
+def next_attempt_in(now: float) -> float | None:
+    query = select(func.min(OutboxMessage.next_attempt_at)).where(OutboxMessage.id.in_(channel_heads()))
+    with database.session() as session:
+        next_attempt_at = session.scalar(query)
+    return None if next_attempt_at is None else max(next_attempt_at - now, 0)
+
+
+def remove_message(message_id: int) -> None:
+    with database.session() as session, session.begin():
+        session.execute(delete(OutboxMessage).where(OutboxMessage.id == message_id))
+
+
+def prune_failed(now: float) -> None:
+    query = delete(OutboxMessage).where(
+        OutboxMessage.status == OutboxStatus.FAILED.value,
+        OutboxMessage.next_attempt_at < now - settings.OUTBOX_FAILED_RETENTION,
+    )
+    with database.session() as session, session.begin():
+        session.execute(query)
+
+
+def record_failure(message_id: int, error: str, now: float) -> OutboxMessage:
+    with database.session() as session, session.begin():
+        message = session.get(OutboxMessage, message_id)
+        message.attempts += 1
+        message.last_error = error
+        if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            message.status = OutboxStatus.FAILED.value
+            # Never attempted again, so this records when it was given up on instead
+            message.next_attempt_at = now
+        else:
+            delay = settings.OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1)
+            message.next_attempt_at = now + min(delay, settings.OUTBOX_MAX_RETRY_DELAY)
+        return message
+
+
+class Outbox:
+    """Announcements stored in SQLite until Discord has accepted them.
+
+    A single task, in the leader worker only, sends each channel's messages strictly in the order they were queued,
+    retrying the oldest with backoff before moving on, so announcements survive restarts and upstream outages.
+    Messages given up on are kept for OUTBOX_FAILED_RETENTION seconds so they can be looked into.
+    """
+
+    def __init__(self) -> None:
+        self._wake: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def enqueue(
+        self,
+        channel_id: int,
+        text: str | None = None,
+        mentions: list[str] = [],
+        embeds: list[Embed] | None = None,
+    ) -> list[ResponseData]:
+        """Durably queue a message, returning once it's stored rather than once it's sent."""
+        messages = build_messages(text, mentions, embeds)
+        await asyncio.to_thread(store_messages, channel_id, messages, time.time())
+
+        if self._wake is not None:
+            self._wake.set()
+        return messages
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._wake = asyncio.Event()
+            self._worker = asyncio.create_task(self._run(self._wake))
+
+    async def stop(self) -> None:
+        worker, self._worker, self._wake = self._worker, None, None
+        if worker is not None:
+            worker.cancel()
+            with suppress(asyncio.CancelledError):
+                await worker
+
+    async def drain(self) -> float | None:
+        """Send every message that's due, returning the seconds until a retry is next due, if any."""
+        await asyncio.to_thread(prune_failed, time.time())
+        while True:
+            now = time.time()
+            messages = await asyncio.to_thread(due_messages, now)
+            if not messages:
+                return await asyncio.to_thread(next_attempt_in, now)
+
+            # Channels are independent of each other, only messages within one have to go one at a time
+            await asyncio.gather(*(self._deliver(message) for message in messages))
+
+    async def _deliver(self, message: OutboxMessage) -> None:
+        try:
+            await utility.post([HTTP_200_OK], f"{CHANNELS_URL}/{message.channel_id}/messages", json=message.payload)
+        except Exception as e:
+            failed = await asyncio.to_thread(record_failure, message.id, str(e), time.time())
+            if failed.status == OutboxStatus.FAILED.value:
+                gunicorn_logger.error(f"Giving up on message {message.id} to {message.channel_id}:\n{e}")
+            else:
+                gunicorn_logger.warning(f"Error sending message {message.id} to {message.channel_id}, will retry:\n{e}")
+            return
+
+        await asyncio.to_thread(remove_message, message.id)
+
+    async def _run(self, wake: asyncio.Event) -> None:
+        while True:
+            wake.clear()
+            try:
+                delay = await self.drain()
+            except Exception as e:
+                gunicorn_logger.error(f"Error draining the outbox:\n{e}")
+                delay = settings.OUTBOX_RETRY_DELAY
+
+            # Messages queued by other workers can't wake this one, so look for them every so often too
+            poll = settings.OUTBOX_POLL_INTERVAL
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(wake.wait(), poll if delay is None else min(delay, poll))
+
+
+outbox = Outbox()
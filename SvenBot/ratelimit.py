@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+import httpx
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+# Path segments whose id is part of the rate limit bucket rather than collapsed into the route
+MAJOR_PARAMETERS = frozenset(("channels", "guilds", "webhooks"))
+# Waits shorter than this are just lock handoffs, not requests held back by a limit
+QUEUED_THRESHOLD = 0.001
+# Seconds between sweeps for buckets that are idle and past their reset
+PRUNE_INTERVAL = 60.0
+
+
+def route_key(method: str, url: httpx.URL) -> tuple[str, str]:
+    """Split a Discord request into its route (ids collapsed) and its major parameter."""
+    segments = url.path.split("/")
+    major = ""
+
+    for i, segment in enumerate(segments):
+        if not segment.isdigit():
+            continue
+        if segments[i - 1] in MAJOR_PARAMETERS and not major:
+            major = segment
+            # A webhook's token is part of its major parameter, and is different for every interaction
+            if segments[i - 1] == "webhooks" and i + 1 < len(segments):
+                major = f"{segment}/{segments[i + 1]}"
+                segments[i + 1] = ":token"
+        else:
+            segments[i] = ":id"
+
+    return f"{method} {'/'.join(segments)}", major
+
+
+class Bucket:
+    __slots__ = ("lock", "remaining", "reset_at")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.remaining: int | None = None
+        self.reset_at = 0.0
+
+
+class RateLimitStats:
+    __slots__ = ("queued_requests", "queued_seconds", "rate_limited", "requests")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.queued_requests = 0
+        self.queued_seconds = 0.0
+        self.rate_limited = 0
+
+
+class RateLimiter:
+    """Queues requests per Discord rate limit bucket and under the global request limit.
+
+    Routes start in a bucket of their own until Discord names their bucket via X-RateLimit-Bucket, after which
+    every route sharing that bucket (and major parameter) queues behind the same lock.
+    """
+
+    def __init__(self, global_limit: int = 50, global_period: float = 1.0, max_retries: int = 3) -> None:
+        self.global_limit = global_limit
+        self.global_period = global_period
+        self.max_retries = max_retries
+        self.reset()
+
+    def reset(self) -> None:
+        self.stats = RateLimitStats()
+        self._route_buckets: dict[str, str] = {}
+        self._buckets: dict[str, Bucket] = {}
+        self._global_reset_at = 0.0
+        self._recent: deque[float] = deque(maxlen=self.global_limit)
+        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+
+    async def request(
+        self,
+        method: str,
+        url: httpx.URL,
+        send: Callable[[], Awaitable[httpx.Response]],
+    ) -> httpx.Response:
+        route, major = route_key(method, url)
+        self._prune()
+
+        for attempt in range(self.max_retries + 1):
+            bucket = self._bucket(route, major)
+            queued_at = time.monotonic()
+            async with bucket.lock:
+                await self._wait(bucket, queued_at)
+                response = await send()
+                retry_after = self._update(route, major, bucket, response)
+
+            if retry_after is None or attempt == self.max_retries:
+                return response
+            gunicorn_logger.warning(f"Rate limited on '{route}', retrying in {retry_after}s")
+
+        return response
+
+    def _bucket(self, route: str, major: str) -> Bucket:
+        key = f"{self._route_buckets.get(route, route)}:{major}"
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket()
+        return bucket
+
+    def _prune(self) -> None:
+        """Forget buckets nobody is using whose limit has reset, so one-off routes like webhooks don't pile up."""
+        now = time.monotonic()
+        if now < self._next_prune:
+            return
+
+        self._next_prune = now + PRUNE_INTERVAL
+        for key, bucket in list(self._buckets.items()):
+            if not bucket.lock.locked() and bucket.reset_at <= now:
+                del self._buckets[key]
+
+    async def _wait(self, bucket: Bucket, queued_at: float) -> None:
+        while True:
+            now = time.monotonic()
+            delay = self._global_reset_at - now
+            if bucket.remaining == 0:
+                delay = max(delay, bucket.reset_at - now)
+            if len(self._recent) == self.global_limit:
+                delay = max(delay, self._recent[0] + self.global_period - now)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        self._recent.append(now)
+        self.stats.requests += 1
+        if now - queued_at > QUEUED_THRESHOLD:
+            self.stats.queued_requests += 1
+            self.stats.queued_seconds += now - queued_at
+
+    def _update(self, route: str, major: str, bucket: Bucket, response: httpx.Response) -> float | None:
+        """Record the rate limit headers of a response, returning how long to wait before retrying a 429."""
+        headers = response.headers
+        now = time.monotonic()
+
+        bucket_hash = headers.get("X-RateLimit-Bucket")
+        if bucket_hash is not None and self._route_buckets.get(route) != bucket_hash:
+            self._route_buckets[route] = bucket_hash
+            self._buckets.setdefault(f"{bucket_hash}:{major}", bucket)
+
+        if "X-RateLimit-Remaining" in headers:
+            bucket.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset-After" in headers:
+            bucket.reset_at = now + float(headers["X-RateLimit-Reset-After"])
+
+        if response.status_code != HTTP_429_TOO_MANY_REQUESTS:
+            return None
+
+        self.stats.rate_limited += 1
+        try:
+            retry_after = float(response.json()["retry_after"])
+        except Exception:
+            retry_after = float(headers.get("Retry-After", 1))
+
+        if headers.get("X-RateLimit-Global") == "true" or headers.get("X-RateLimit-Scope") == "global":
+            self._global_reset_at = now + retry_after
+        else:
+            bucket.remaining = 0
+            bucket.reset_at = now + retry_after
+        return retry_after
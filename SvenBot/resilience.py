@@ -0,0 +1,120 @@
+import logging
+import random
+import time
+from enum import Enum
+
+from starlette.status import (
+    HTTP_500_INTERNAL_SERVER_ERROR,
+    HTTP_502_BAD_GATEWAY,
+    HTTP_503_SERVICE_UNAVAILABLE,
+    HTTP_504_GATEWAY_TIMEOUT,
+)
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+
+class UpstreamUnavailableError(RuntimeError):
+    def __init__(self, upstream: str, retry_in: float) -> None:
+        super().__init__(f"{upstream} is unavailable, retrying in {retry_in:.0f}s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class RetryPolicy:
+    """Jittered exponential backoff for idempotent requests, bounded by attempts and total elapsed time."""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 5.0,
+        max_elapsed: float = 15.0,
+        statuses: frozenset[int] = frozenset(
+            (
+                HTTP_500_INTERNAL_SERVER_ERROR,
+                HTTP_502_BAD_GATEWAY,
+                HTTP_503_SERVICE_UNAVAILABLE,
+                HTTP_504_GATEWAY_TIMEOUT,
+            ),
+        ),
+        methods: frozenset[str] = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE")),
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.statuses = statuses
+        self.methods = methods
+
+    def allows(self, method: str, idempotent: bool | None = None) -> bool:
+        return method in self.methods if idempotent is None else idempotent
+
+    def delay(self, attempt: int, elapsed: float) -> float | None:
+        """Seconds to sleep before the next attempt, or None once attempts or the elapsed budget run out."""
+        if attempt + 1 >= self.max_attempts:
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if elapsed + delay > self.max_elapsed:
+            return None
+        return delay
+
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after consecutive failures, then lets a single trial request through per reset."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial_started: float | None = None
+
+    def _transition(self, state: BreakerState) -> None:
+        if state != self.state:
+            gunicorn_logger.warning(f"Circuit breaker for '{self.name}' {self.state.value} -> {state.value}")
+            self.state = state
+
+    def before_request(self) -> None:
+        if self.state == BreakerState.CLOSED:
+            return
+
+        now = time.monotonic()
+        retry_in = self.opened_at + self.reset_timeout - now
+        if self.state == BreakerState.OPEN and retry_in <= 0:
+            self._transition(BreakerState.HALF_OPEN)
+
+        # A trial that never reported back (e.g. it was cancelled) shouldn't hold the breaker half open forever
+        trial_expired = self._trial_started is None or now - self._trial_started > self.reset_timeout
+        if self.state == BreakerState.HALF_OPEN and trial_expired:
+            self._trial_started = now
+            return
+
+        raise UpstreamUnavailableError(self.name, max(retry_in, 0))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_started = None
+        self._transition(BreakerState.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_started = None
+
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+            self._transition(BreakerState.OPEN)
@@ -0,0 +1,118 @@
+import heapq
+from bisect import bisect_left
+from collections.abc import Callable
+
+RoleValidator = Callable[[dict, int], bool]
+
+# Sorts after any character in a role name, so `query + PREFIX_END` bounds every name starting with query
+PREFIX_END = "\U0010ffff"
+
+
+class RoleIndex:
+    """Lookups over a single guild roles payload, built once so commands don't re-scan the role list."""
+
+    __slots__ = (
+        "_joinable",
+        "_sorted_names",
+        "_sorted_roles",
+        "_valid",
+        "bot_position",
+        "by_id",
+        "by_name",
+        "roles",
+        "validator",
+    )
+
+    def __init__(self, roles: list[dict], bot_id: str, validator: RoleValidator | None) -> None:
+        self.roles = roles
+        self.validator = validator
+        self.by_id: dict[str, dict] = {}
+        self.by_name: dict[str, dict] = {}
+        self.bot_position = -1
+
+        for role in roles:
+            self.by_id[role["id"]] = role
+            self.by_name.setdefault(role["name"].lower(), role)
+            if self.bot_position == -1 and role.get("tags", {}).get("bot_id") == bot_id:
+                self.bot_position = role["position"]
+
+        self._valid: dict[str, bool] = {}
+        if self.bot_position != -1 and validator is not None:
+            self._valid = {role["id"]: validator(role, self.bot_position) for role in roles}
+        self._joinable = sorted(role["name"] for role in roles if self._valid.get(role["id"], False))
+
+        by_lower_name = sorted(((role["name"].lower(), role) for role in roles), key=lambda pair: pair[0])
+        self._sorted_names = [name for name, _ in by_lower_name]
+        self._sorted_roles = [role for _, role in by_lower_name]
+
+    def _require_bot_position(self) -> None:
+        if self.bot_position == -1:
+            raise RuntimeError("Unable to find bot's role")
+
+    def is_valid(self, role: dict) -> bool:
+        self._require_bot_position()
+        if self.validator is None:
+            return False
+
+        valid = self._valid.get(role["id"])
+        if valid is None or role is not self.by_id.get(role["id"]):
+            return self.validator(role, self.bot_position)
+        return valid
+
+    def joinable_names(self) -> list[str]:
+        self._require_bot_position()
+        return self._joinable
+
+    def prefix_matches(self, query: str, limit: int = 25) -> list[dict]:
+        """Roles whose name starts with query (case-insensitive), shortest and then alphabetical first."""
+        query = query.lower()
+        start = bisect_left(self._sorted_names, query)
+        end = bisect_left(self._sorted_names, query + PREFIX_END, lo=start)
+
+        ranked = heapq.nsmallest(
+            limit,
+            range(start, end),
+            key=lambda i: (len(self._sorted_names[i]), self._sorted_names[i]),
+        )
+        return [self._sorted_roles[i] for i in ranked]
+
+
+class MemberIndex:
+    """Usernames holding each role, filled in page by page from the guild member list."""
+
+    __slots__ = ("role_members", "usernames")
+
+    def __init__(self) -> None:
+        self.usernames: dict[str, str] = {}
+        # Dicts rather than sets so members stay in the order Discord listed them
+        self.role_members: dict[str, dict[str, None]] = {}
+
+    def add_members(self, members: list[dict]) -> None:
+        for member in members:
+            user = member["user"]
+            self.usernames[user["id"]] = user["username"]
+            for role_id in member["roles"]:
+                self.role_members.setdefault(role_id, {})[user["id"]] = None
+
+    def add_role(self, user_id: str, username: str, role_id: str) -> None:
+        self.usernames[user_id] = username
+        self.role_members.setdefault(role_id, {})[user_id] = None
+
+    def remove_role(self, user_id: str, role_id: str) -> None:
+        self.role_members.get(role_id, {}).pop(user_id, None)
+
+    def members_with_role(self, role_id: str) -> list[str]:
+        return [self.usernames[user_id] for user_id in self.role_members.get(role_id, {})]
+
+    def as_dict(self) -> dict:
+        return {
+            "usernames": self.usernames,
+            "role_members": {role_id: list(user_ids) for role_id, user_ids in self.role_members.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, index: dict) -> "MemberIndex":
+        members = cls()
+        members.usernames = dict(index["usernames"])
+        members.role_members = {role_id: dict.fromkeys(user_ids) for role_id, user_ids in index["role_members"].items()}
+        return members
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import re
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from SvenBot import archub
+from SvenBot.config import BASE_ARCHUB_URL, EVENT_PINGS, HUB_URL, settings
+from SvenBot.database import SlackEventReceipt, database
+from SvenBot.models import Embed, EmbedField, EmbedThumbnail, SlackCalendarEvent, SlackEvent
+from SvenBot.outbox import outbox
+from SvenBot.utility import mission_colour_from_mode
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+TITLE_PATTERN = re.compile(r"<!date\^(\d+)\^\{\w+\}.*? - <!date\^(\d+)\^\{\w+}.*?<.*?\|(.*)>")
+# Announcements for this event also list the missions of the next operation
+MISSIONS_EVENT = "main"
+
+
+class EventRule:
+    __slots__ = ("channel", "colour", "name", "pings")
+
+    def __init__(self, name: str, roles: list[int], channel: int, colour: int | None) -> None:
+        self.name = name
+        self.pings = " ".join(f"<@&{role}>" for role in roles)
+        self.channel = channel
+        self.colour = colour
+
+
+class EventMatcher:
+    """Every event rule compiled into one pattern, so a title is classified in a single pass.
+
+    Each rule is a lookahead from the start of the title, tried in order, so the first rule found anywhere in the
+    title wins just as if the rules were searched for one after another.
+    """
+
+    def __init__(self, rules: dict[str, tuple[list[int], int, int | None]]) -> None:
+        self.rules = [EventRule(name, *rule) for name, rule in rules.items()]
+        branches = "|".join(f"(?=.*?(?:{name}))(?P<rule{i}>)" for i, name in enumerate(rules))
+        self.pattern = re.compile(f"^(?:{branches})", re.IGNORECASE | re.DOTALL) if rules else None
+
+    def match(self, title: str) -> EventRule | None:
+        matched = self.pattern.match(title) if self.pattern is not None else None
+        if matched is None or matched.lastgroup is None:
+            return None
+        return self.rules[int(matched.lastgroup.removeprefix("rule"))]
+
+
+event_matcher = EventMatcher(EVENT_PINGS)
+
+
+def mission_embeds(missions: list[dict]) -> list[Embed]:
+    embeds = []
+    for mission in missions:
+        link = f"{HUB_URL}/missions/{mission['id']}"
+        maker_string = "Maintained" if mission["hasMaintainer"] else "Made"
+
+        thumbnail: EmbedThumbnail | None
+        if " " in mission["thumbnail"]:
+            gunicorn_logger.info(f"Skipping thumbnail for mission {mission['id']}")
+            thumbnail = None
+        else:
+            thumbnail = EmbedThumbnail(url=f"{BASE_ARCHUB_URL}{mission['thumbnail']}")
+
+        embeds.append(
+            Embed(
+                title=mission["display_name"],
+                description=f"{maker_string} by {mission['user']}",
+                url=link,
+                thumbnail=thumbnail,
+                color=mission_colour_from_mode(mission["mode"]),
+            ),
+        )
+    return embeds
+
+
+async def announce_calendar_event(cal: SlackCalendarEvent) -> None:
+    matches = TITLE_PATTERN.match(cal.title or "")
+    if not matches:
+        return
+
+    rule = event_matcher.match(matches.string)
+    pings = rule.pings if rule is not None else None
+    channel = rule.channel if rule is not None else settings.OP_CHANNEL
+    colour = rule.colour if rule is not None else None
+
+    start_time, end_time, title = matches.groups()
+    fields = [
+        EmbedField(name="Start", value=f"<t:{start_time}:t>", inline=True),
+        EmbedField(name="End", value=f"<t:{end_time}:t>", inline=True),
+    ]
+    embeds = [
+        Embed(title=title, description=f"Starting <t:{start_time}:R>", fields=fields, color=colour),
+    ]
+
+    if rule is not None and rule.name == MISSIONS_EVENT:
+        embeds.extend(mission_embeds(await archub.get_operation_missions()))
+
+    await outbox.enqueue(channel, pings, ["roles"], embeds)
+
+
+async def try_announce_calendar_event(cal: SlackCalendarEvent) -> None:
+    try:
+        await announce_calendar_event(cal)
+    except Exception as e:
+        gunicorn_logger.error(f"Error announcing calendar event '{cal.title}':\n{e}")
+
+
+async def process_event(event: SlackEvent) -> None:
+    """Announce every calendar event in a notification, which may be a digest of several, in order."""
+    for cal in event.attachments or []:
+        await try_announce_calendar_event(cal)
+
+
+def claim_event(event_id: str, now: float) -> bool:
+    """Record an event as received, returning False if it already had been (by any worker)."""
+    try:
+        with database.session() as session, session.begin():
+            session.execute(
+                delete(SlackEventReceipt).where(SlackEventReceipt.received_at < now - settings.SLACK_EVENT_RETENTION),
+            )
+            session.add(SlackEventReceipt(event_id=event_id, received_at=now))
+    except IntegrityError:
+        return False
+    return True
+
+
+async def accept_event(event_id: str | None, retry_num: str | None) -> bool:
+    """Whether an event should be processed, so Slack's retries of one we've already taken are no-ops."""
+    if event_id is None:
+        if retry_num is not None:
+            gunicorn_logger.warning(f"Processing retry {retry_num} of a Slack event without an event_id")
+        return True
+
+    if not await asyncio.to_thread(claim_event, event_id, time.time()):
+        gunicorn_logger.info(f"Ignoring duplicate Slack event {event_id} (retry {retry_num})")
+        return False
+    return True
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+from SvenBot.config import settings
+
+gunicorn_logger = logging.getLogger("gunicorn.error")
+
+
+class StateFile:
+    """A small JSON document under STATE_DIR, kept in memory and replaced atomically on every save.
+
+    Reads and writes happen on a worker thread. A write goes to a temporary file that is then renamed over the
+    old one, so a crash leaves either the previous or the new state, never half of one.
+    """
+
+    def __init__(self, name: str, default: dict) -> None:
+        self.name = name
+        self.default = default
+        self.reset()
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.STATE_DIR) / self.name
+
+    def reset(self) -> None:
+        self._state: dict | None = None
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> dict:
+        async with self._lock:
+            if self._state is None:
+                self._state = await asyncio.to_thread(self._read)
+            return dict(self._state)
+
+    async def save(self, state: dict) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._write, state)
+            self._state = dict(state)
+
+    def _read(self) -> dict:
+        try:
+            with self.path.open() as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict(self.default)
+        except ValueError:
+            # Resetting to the default would re-announce everything, so make someone look at it instead
+            gunicorn_logger.error(f"State file {self.path} is corrupt")
+            raise
+
+    def _write(self, state: dict) -> None:
+        path = self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.tmp")
+
+        with temporary.open("w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        temporary.replace(path)
@@ -1,136 +1,264 @@
-import json
+import asyncio
 import logging
-from datetime import datetime
-from pathlib import Path
+import time
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from sqlalchemy import delete, select
 from starlette.status import HTTP_200_OK
 
-from SvenBot import utility
+from SvenBot import a3sync, utility
 from SvenBot.config import REPO_URL, STEAM_URL, settings
+from SvenBot.database import SteamCollection, SteamMod, database
 from SvenBot.models import ResponseData
+from SvenBot.outbox import outbox
+from SvenBot.state import StateFile
 
 gunicorn_logger = logging.getLogger("gunicorn.error")
 
-REVISION_PATH = Path("revision.json")
-TIMESTAMP_PATH = Path("steam_timestamp.json")
+revision_state = StateFile("revision.json", {"revision": 0})
 
+STEAM_FILETYPE_ITEM = 0
+STEAM_FILETYPE_COLLECTION = 2
+STEAM_CONCURRENCY = 4
+COLLECTION_BATCH_SIZE = 100
+STEAM_CHANGELOG_TIMEOUT = 15
 
-async def recruit_task() -> ResponseData:
+
+async def recruit_task() -> list[ResponseData]:
     gunicorn_logger.info("Recruit task")
-    return await utility.send_message(
+    return await outbox.enqueue(
         settings.STAFF_CHANNEL,
         f"<@&{settings.ADMIN_ROLE}> Post recruitment on <https://www.reddit.com/r/FindAUnit>",
         ["roles"],
     )
 
 
-async def a3sync_task() -> ResponseData | None:
+async def a3sync_task() -> list[ResponseData] | None:
     r = await utility.get([HTTP_200_OK], f"{REPO_URL}/repo")
     repo_info = r.json()
 
-    with REVISION_PATH.open() as f:
-        revision = json.load(f)
+    revision = await revision_state.load()
 
     if repo_info["revision"] != revision["revision"]:
-        r = await utility.get([HTTP_200_OK], f"{REPO_URL}/changelog")
-        changelogs = r.json()["list"]
+        await a3sync.sync_changelog(repo_info["revision"])
 
         new_repo_size = round((float(repo_info["totalFilesSize"]) / 1000000000), 2)
         update_post = f"```md\n# The A3Sync repo has changed #\n\n[{new_repo_size} GB]\n```\n"
-        for changelog in changelogs:
-            if changelog["revision"] > revision["revision"]:
-                new = (
-                    ""
-                    if (len(changelog["newAddons"]) == 0)
-                    else "< New >\n{}".format("\n".join(changelog["newAddons"]))
-                )
-                deleted = (
-                    ""
-                    if (len(changelog["deletedAddons"]) == 0)
-                    else "\n\n< Deleted >\n{}".format("\n".join(changelog["deletedAddons"]))
-                )
-                updated = (
-                    ""
-                    if (len(changelog["updatedAddons"]) == 0)
-                    else "\n\n< Updated >\n{}".format("\n".join(changelog["updatedAddons"]))
-                )
-                if len(new + deleted + updated) > 0:
-                    update_post += f"```md\n{new}{deleted}{updated}\n```\n"
-
-        revision["revision"] = changelog["revision"]
-
-        with REVISION_PATH.open("w") as f:
-            json.dump(revision, f)
-
-        return await utility.send_message(settings.ANNOUNCE_CHANNEL, update_post)
-    return None
+        for changes in await a3sync.get_revisions(revision["revision"], repo_info["revision"]):
+            update_post += a3sync.render_revision(changes)
 
+        # Only move on once the announcement is queued, so a failure can't skip it
+        messages = await outbox.enqueue(settings.ANNOUNCE_CHANNEL, update_post)
 
-async def steam_task() -> ResponseData | None:
-    with TIMESTAMP_PATH.open() as f:
-        steam_timestamp = json.load(f)
-
-    mods = set(await get_steam_mods(settings.STEAM_MODLIST))
-    data = {"itemcount": len(mods)}
-    for i, mod in enumerate(mods):
-        data[f"publishedfileids[{i}]"] = mod
+        revision["revision"] = repo_info["revision"]
+        await revision_state.save(revision)
+        return messages
+    return None
 
-    r = await utility.post([HTTP_200_OK], f"{STEAM_URL}/GetPublishedFileDetails/v1/", data=data, headers=None)
 
-    update_post = ""
-    now = datetime.utcnow().timestamp()
-    last_checked = steam_timestamp["last_checked"]
+async def steam_task() -> list[ResponseData] | None:
+    mods = await get_collection_mods(settings.STEAM_MODLIST)
+    details, unchecked = await get_published_file_details(mods)
+    if unchecked:
+        gunicorn_logger.warning(f"Unable to check {len(unchecked)} Steam mods for updates: {', '.join(unchecked)}")
 
-    for mod in r.json()["response"]["publishedfiledetails"]:
-        mod_id = mod["publishedfileid"]
-        time_updated = mod.get("time_updated")
-        if not time_updated:
-            continue
+    last_seen = await asyncio.to_thread(load_mod_timestamps, [mod["publishedfileid"] for mod in details])
 
-        if last_checked <= time_updated <= now:
-            changelog_url = f"https://steamcommunity.com/sharedfiles/filedetails/changelog/{mod_id}"
-            update_post += f"**{mod['title']}** has released a new version\n<{changelog_url}>\n"
+    # Mods seen for the first time are only recorded, an update is a timestamp moving past the one we stored
+    updated_mods = [
+        mod
+        for mod in details
+        if mod["publishedfileid"] in last_seen and mod["time_updated"] > last_seen[mod["publishedfileid"]]
+    ]
+    semaphore = asyncio.Semaphore(STEAM_CONCURRENCY)
 
+    async def fetch_changelog(mod_id: str) -> str | None:
+        async with semaphore:
             try:
-                changelog = await get_steam_changelog(changelog_url)
+                return await get_steam_changelog(steam_changelog_url(mod_id))
             except Exception as e:
                 gunicorn_logger.error(f"Error retrieving changelog for {mod_id}:\n{e}")
-                changelog = "Error retrieving changelog"
+                return None
 
-            update_post += f"```\n{changelog}```\n"
-
-    steam_timestamp["last_checked"] = now
-    with TIMESTAMP_PATH.open("w") as f:
-        json.dump(steam_timestamp, f)
+    changelogs = await asyncio.gather(*(fetch_changelog(mod["publishedfileid"]) for mod in updated_mods))
+    new_changelogs = {
+        mod["publishedfileid"]: changelog for mod, changelog in zip(updated_mods, changelogs, strict=True)
+    }
+    update_post = ""
+    for mod, changelog in zip(updated_mods, changelogs, strict=True):
+        changelog_url = steam_changelog_url(mod["publishedfileid"])
+        update_post += f"**{mod['title']}** has released a new version\n<{changelog_url}>\n"
+        update_post += f"```\n{changelog or 'Error retrieving changelog'}```\n"
 
+    messages = None
     if update_post:
-        return await utility.send_message(
-            settings.STAFF_CHANNEL, f"<@&{settings.ADMIN_ROLE}>\n{update_post}", ["roles"]
+        messages = await outbox.enqueue(settings.STAFF_CHANNEL, f"<@&{settings.ADMIN_ROLE}>\n{update_post}", ["roles"])
+
+    # Only record the new timestamps once the announcement is queued, so a failure can't skip it
+    await asyncio.to_thread(save_mod_states, mods, details, new_changelogs)
+    return messages
+
+
+async def get_published_file_details(mods: list[str]) -> tuple[list[dict], list[str]]:
+    """Details of every mod that could be checked, and the ids of those that couldn't.
+
+    Mods are requested in concurrent chunks, each retried on its own, so one failing chunk or item only leaves
+    those mods unchecked.
+    """
+    chunk_size = settings.STEAM_DETAILS_CHUNK_SIZE
+    chunks = [mods[i : i + chunk_size] for i in range(0, len(mods), chunk_size)]
+    semaphore = asyncio.Semaphore(STEAM_CONCURRENCY)
+
+    async def fetch(chunk: list[str]) -> list[dict]:
+        data: dict[str, int | str] = {"itemcount": len(chunk)}
+        for i, mod in enumerate(chunk):
+            data[f"publishedfileids[{i}]"] = mod
+
+        async with semaphore:
+            r = await utility.post(
+                [HTTP_200_OK], f"{STEAM_URL}/GetPublishedFileDetails/v1/", data=data, headers=None, idempotent=True
+            )
+        return r.json()["response"]["publishedfiledetails"]
+
+    details: list[dict] = []
+    unchecked: list[str] = []
+    for chunk, result in zip(chunks, await asyncio.gather(*map(fetch, chunks), return_exceptions=True), strict=True):
+        if isinstance(result, BaseException):
+            gunicorn_logger.error(f"Error retrieving details for {len(chunk)} Steam mods:\n{result}")
+            unchecked.extend(chunk)
+            continue
+
+        for mod in result:
+            if mod.get("time_updated"):
+                details.append(mod)
+            else:
+                unchecked.append(mod["publishedfileid"])
+
+    return details, unchecked
+
+
+def load_mod_timestamps(mod_ids: list[str]) -> dict[str, int]:
+    with database.session() as session:
+        rows = session.execute(
+            select(SteamMod.publishedfileid, SteamMod.time_updated).where(SteamMod.publishedfileid.in_(mod_ids)),
         )
-    return None
+        return dict(rows.all())
+
+
+def save_mod_states(mods: list[str], details: list[dict], changelogs: dict[str, str | None]) -> None:
+    """Record the latest details of every checked mod, and forget mods that have left the collection."""
+    with database.session() as session, session.begin():
+        stored = {
+            mod.publishedfileid: mod
+            for mod in session.scalars(select(SteamMod).where(SteamMod.publishedfileid.in_(mods)))
+        }
+        for detail in details:
+            mod = stored.get(detail["publishedfileid"])
+            if mod is None:
+                mod = SteamMod(publishedfileid=detail["publishedfileid"])
+                session.add(mod)
+            mod.title = detail["title"]
+            mod.time_updated = detail["time_updated"]
+            if detail["publishedfileid"] in changelogs:
+                mod.changelog = changelogs[detail["publishedfileid"]]
+
+        session.execute(delete(SteamMod).where(SteamMod.publishedfileid.not_in(mods)))
+
+
+def load_collection(collection_id: str) -> tuple[list[str], float] | None:
+    with database.session() as session:
+        collection = session.get(SteamCollection, collection_id)
+        return None if collection is None else (collection.mods, collection.refreshed_at)
+
+
+def save_collection(collection_id: str, mods: list[str], refreshed_at: float) -> None:
+    with database.session() as session, session.begin():
+        session.merge(SteamCollection(collection_id=collection_id, mods=mods, refreshed_at=refreshed_at))
+
+
+async def get_collection_mods(collection_id: int) -> list[str]:
+    """The mods in a collection, only walking its nested collections again once the stored list is due a refresh."""
+    cached = await asyncio.to_thread(load_collection, str(collection_id))
+    now = time.time()
+    if cached is not None and now - cached[1] < settings.STEAM_COLLECTION_REFRESH:
+        return cached[0]
+
+    try:
+        mods = await get_steam_mods(collection_id)
+    except Exception as e:
+        if cached is None:
+            raise
+        gunicorn_logger.warning(f"Unable to refresh collection {collection_id}, using the stored list:\n{e}")
+        return cached[0]
+
+    await asyncio.to_thread(save_collection, str(collection_id), mods, now)
+    return mods
+
+
+async def get_collection_details(collection_ids: list[str]) -> list[dict]:
+    data: dict[str, int | str] = {"collectioncount": len(collection_ids)}
+    for i, collection_id in enumerate(collection_ids):
+        data[f"publishedfileids[{i}]"] = collection_id
+
+    r = await utility.post(
+        [HTTP_200_OK], f"{STEAM_URL}/GetCollectionDetails/v1/", data=data, headers=None, idempotent=True
+    )
+    return r.json()["response"]["collectiondetails"]
 
 
 async def get_steam_mods(collection_id: int) -> list[str]:
-    data = {"collectioncount": 1, "publishedfileids[0]": collection_id}
-    mods: list[str] = []
+    """Every mod in a collection and its nested collections, fetching each depth of nesting in batched requests."""
+    mods: dict[str, None] = {}
+    visited = {str(collection_id)}
+    depth = [str(collection_id)]
+    semaphore = asyncio.Semaphore(STEAM_CONCURRENCY)
 
-    r = await utility.post([HTTP_200_OK], f"{STEAM_URL}/GetCollectionDetails/v1/", data=data, headers=None)
-    response = r.json()
+    async def fetch(batch: list[str]) -> list[dict]:
+        async with semaphore:
+            return await get_collection_details(batch)
 
-    for collection in response["response"]["collectiondetails"]:
-        for child in collection["children"]:
-            if child["filetype"] == 0:
-                mods.append(child["publishedfileid"])
-            elif child["filetype"] == 2:
-                mods += await get_steam_mods(child["publishedfileid"])
+    while depth:
+        batches = [depth[i : i + COLLECTION_BATCH_SIZE] for i in range(0, len(depth), COLLECTION_BATCH_SIZE)]
+        next_depth: list[str] = []
 
-    return mods
+        for collections in await asyncio.gather(*(fetch(batch) for batch in batches)):
+            for collection in collections:
+                for child in collection.get("children", []):
+                    child_id = str(child["publishedfileid"])
+                    if child["filetype"] == STEAM_FILETYPE_ITEM:
+                        mods[child_id] = None
+                    elif child["filetype"] == STEAM_FILETYPE_COLLECTION and child_id not in visited:
+                        visited.add(child_id)
+                        next_depth.append(child_id)
 
+        depth = next_depth
 
-async def get_steam_changelog(changelog_url: str) -> str:
-    r = await utility.get([HTTP_200_OK], changelog_url, headers=None)
-    soup = BeautifulSoup(r.text, features="html.parser")
+    return list(mods)
+
+
+def steam_changelog_url(mod_id: str) -> str:
+    return f"https://steamcommunity.com/sharedfiles/filedetails/changelog/{mod_id}"
+
+
+def is_changelog_part(name: str, attrs: dict[str, str] | None = None) -> bool:
+    # While parsing, the strainer calls this with each tag's attributes too
+    return name == "p" or (name == "div" and attrs is not None and attrs.get("class") == "changelog headline")
+
+
+# Only headlines and paragraphs are kept, so the rest of the (large) Steam page is never built into a tree
+CHANGELOG_STRAINER = SoupStrainer(is_changelog_part)
+
+
+def parse_steam_changelog(html: str) -> str:
+    soup = BeautifulSoup(html, features="html.parser", parse_only=CHANGELOG_STRAINER)
     headline = soup.find("div", {"class": "changelog headline"})
+    changelog = headline.find_next("p") if headline is not None else None
+    if changelog is None:
+        raise ValueError("No changelog on the page")
+
+    return changelog.get_text(separator="\n")
 
-    return headline.findNext("p").get_text(separator="\n")
+
+async def get_steam_changelog(changelog_url: str) -> str:
+    r = await utility.get([HTTP_200_OK], changelog_url, headers=None, timeout=STEAM_CHANGELOG_TIMEOUT)
+    return await asyncio.to_thread(parse_steam_changelog, r.text)
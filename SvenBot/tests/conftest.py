@@ -0,0 +1,26 @@
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from SvenBot import archub, clients, metrics, tasks, utility
+from SvenBot.config import settings
+from SvenBot.database import database
+
+
+@pytest.fixture(autouse=True)
+def clear_caches(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Iterator[None]:
+    utility.role_cache.clear()
+    utility.member_cache.clear()
+    archub.response_cache.clear()
+    utility.rate_limiter.reset()
+    clients.registry.reset()
+    metrics.registry.reset()
+    database.configure(f"sqlite:///{tmp_path / 'svenbot.db'}")
+    monkeypatch.setattr(settings, "STATE_DIR", str(tmp_path))
+    tasks.revision_state.reset()
+    yield
+    utility.role_cache.clear()
+    utility.member_cache.clear()
+    archub.response_cache.clear()
+    database.close()
@@ -0,0 +1,100 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from SvenBot import cache
+from SvenBot.cache import AsyncTTLCache, MemoryBackend, SQLiteBackend
+
+
+def worker_cache() -> AsyncTTLCache[str, list[str]]:
+    """A cache as one worker would build it, sharing its entries with every other through the database."""
+    return AsyncTTLCache(ttl=60, stale_ttl=0, backend=SQLiteBackend("test", 4, list, lambda _key, value: value))
+
+
+@pytest.mark.asyncio
+async def test_shared_entries_and_invalidation() -> None:
+    first, second = worker_cache(), worker_cache()
+    loads: list[int] = []
+
+    async def loader() -> list[str]:
+        loads.append(len(loads))
+        return [f"load {len(loads)}"]
+
+    assert await first.get("key", loader) == ["load 1"]
+    assert await second.get("key", loader) == ["load 1"]
+
+    await second.invalidate("key")
+
+    assert await first.get("key", loader) == ["load 2"]
+    assert await second.get("key", loader) == ["load 2"]
+    assert len(loads) == len(["load 1", "load 2"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("shared", [False, True])
+async def test_invalidated_mid_load_is_not_kept(shared: bool) -> None:
+    backend = SQLiteBackend("test", 4, list, lambda _key, value: value) if shared else MemoryBackend(4)
+    cache: AsyncTTLCache[str, list[str]] = AsyncTTLCache(ttl=60, stale_ttl=0, backend=backend)
+    loading, release = asyncio.Event(), asyncio.Event()
+
+    async def slow_loader() -> list[str]:
+        loading.set()
+        await release.wait()
+        return ["before"]
+
+    async def loader() -> list[str]:
+        return ["after"]
+
+    load = asyncio.create_task(cache.get("key", slow_loader))
+    await loading.wait()
+    await cache.invalidate("key")
+    release.set()
+
+    assert await load == ["before"]
+    assert await cache.get("key", loader) == ["after"]
+
+
+@pytest.mark.asyncio
+async def test_shared_modify() -> None:
+    first, second = worker_cache(), worker_cache()
+    loads: list[int] = []
+
+    async def loader() -> list[str]:
+        loads.append(len(loads))
+        return [f"load {len(loads)}"]
+
+    assert await first.get("key", loader) == ["load 1"]
+    assert await second.get("key", loader) == ["load 1"]
+
+    # A shared value is reloaded rather than patched
+    await first.modify("key", lambda value: value.append("changed"))
+
+    assert await second.get("key", loader) == ["load 2"]
+    assert await first.get("key", loader) == ["load 2"]
+    assert loads == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_shared_hits_skip_the_value(monkeypatch: pytest.MonkeyPatch) -> None:
+    first, second = worker_cache(), worker_cache()
+    fetched: list[bool] = []
+    read_record = cache.read_record
+
+    def counted_read(key: str, known: tuple[float, int] | None) -> tuple[Any, float, int] | None:
+        record = read_record(key, known)
+        fetched.append(record is not None and record[0] is not None)
+        return record
+
+    monkeypatch.setattr(cache, "read_record", counted_read)
+
+    async def loader() -> list[str]:
+        return ["loaded"]
+
+    await first.get("key", loader)
+    await first.get("key", loader)
+    await second.get("key", loader)
+    await second.get("key", loader)
+
+    # Only the second worker's first hit needs the value, the first worker stored it and has it already
+    assert fetched == [False, False, True, False]
@@ -0,0 +1,24 @@
+from SvenBot.slack import TITLE_PATTERN, EventMatcher
+
+
+def test_title_pattern() -> None:
+    title = (
+        "<!date^100^{time}|7:00 PM> - <!date^200^{time}|11:00 PM> <https://calendar/event?eid=abc|ARCOMM Main Event>"
+    )
+
+    assert TITLE_PATTERN.match(title).groups() == ("100", "200", "ARCOMM Main Event")
+    assert TITLE_PATTERN.match("Not a calendar event") is None
+
+
+def test_event_matcher_keeps_rule_order() -> None:
+    matcher = EventMatcher({"main": ([1], 10, 0xFF), "recruit": ([2], 20, None), "t(v|e)t": ([3], 30, None)})
+
+    assert matcher.match("ARCOMM RECRUIT and MAIN event").name == "main"
+    assert matcher.match("ARCOMM Recruit event").name == "recruit"
+    assert matcher.match("Weekend TvT").name == "t(v|e)t"
+    assert matcher.match("Something else") is None
+    assert matcher.match("Main").pings == "<@&1>"
+
+
+def test_event_matcher_without_rules() -> None:
+    assert EventMatcher({}).match("ARCOMM MAIN EVENT") is None
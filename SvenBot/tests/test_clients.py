@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+from starlette.status import HTTP_200_OK
+
+from SvenBot.clients import Upstream, registry
+from SvenBot.config import ARCHUB_API, GUILD_URL, REPO_URL, STEAM_URL
+
+
+def test_for_url() -> None:
+    assert registry.for_url(httpx.URL(GUILD_URL)).name == "discord"
+    assert registry.for_url(httpx.URL(ARCHUB_API)).name == "archub"
+    assert registry.for_url(httpx.URL(REPO_URL)).name == "a3sync"
+    assert registry.for_url(httpx.URL(STEAM_URL)).name == "steam"
+    assert registry.for_url(httpx.URL("https://steamcommunity.com/sharedfiles")).name == "steam"
+    assert registry.for_url(httpx.URL("https://example.com")).name == "other"
+
+
+@pytest.mark.asyncio
+async def test_pool_wait(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(url="https://example.com", status_code=HTTP_200_OK)
+    upstream = Upstream("test", ("example.com",), httpx.Limits(max_connections=1), httpx.Timeout(1))
+
+    client, slots = upstream._connection()  # noqa: SLF001
+    request = client.build_request("GET", "https://example.com")
+
+    # Hold the only connection slot so the request has to wait for it
+    await slots.acquire()
+    sending = asyncio.create_task(upstream.send(request))
+    await asyncio.sleep(0.02)
+    slots.release()
+    await sending
+    await upstream.aclose()
+
+    assert upstream.stats.requests == 1
+    assert upstream.stats.pool_waits == 1
+    assert upstream.stats.max_pool_wait >= 0.02  # noqa: PLR2004
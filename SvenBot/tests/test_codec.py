@@ -0,0 +1,84 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from SvenBot import codec
+from SvenBot.codec import FastInteraction, decode_interaction, encode_response
+from SvenBot.interactions import handle_interaction
+from SvenBot.models import Interaction, InteractionType, OptionType
+from SvenBot.utility import EPHEMERAL_FLAG, autocomplete_reply, deferred_reply, immediate_reply
+
+payload = {
+    "id": "MockRequestId",
+    "application_id": "MockAppId",
+    "type": InteractionType.APPLICATION_COMMAND,
+    "token": "MockToken",
+    "version": 1,
+    "guild_id": "342006395010547712",
+    "member": {
+        "user": {"id": "User234", "username": "TestUser2", "discriminator": "4042"},
+        "roles": ["RoleId456"],
+        "permissions": "0",
+    },
+    "data": {
+        "id": "MockCommandId",
+        "name": "optime",
+        "options": [{"name": "modifier", "type": OptionType.INTEGER, "value": -1}],
+    },
+}
+
+
+def test_decode_interaction_matches_models() -> None:
+    body = json.dumps(payload).encode()
+    fast = decode_interaction(body)
+    slow = Interaction.parse_raw(body)
+
+    assert isinstance(fast, FastInteraction)
+    assert [fast.id, fast.application_id, fast.type, fast.token, fast.guild_id] == [
+        slow.id,
+        slow.application_id,
+        slow.type,
+        slow.token,
+        slow.guild_id,
+    ]
+    assert [fast.member.user.id, fast.member.user.username, fast.member.roles] == [
+        slow.member.user.id,
+        slow.member.user.username,
+        slow.member.roles,
+    ]
+    assert [(option.name, option.value, option.options) for option in fast.data.options] == [
+        (option.name, option.value, option.options) for option in slow.data.options
+    ]
+
+
+def test_decode_interaction_falls_back() -> None:
+    # A user instead of a member, as in a DM, is still read by the fast path
+    body = json.dumps({**payload, "member": None, "user": {"id": "1", "username": "a", "discriminator": "1"}})
+    assert isinstance(decode_interaction(body.encode()), FastInteraction)
+
+    with pytest.raises(ValidationError):
+        decode_interaction(b'{"type": 2}')
+    with pytest.raises(ValidationError):
+        decode_interaction(b"not json")
+
+
+@pytest.mark.asyncio
+async def test_fast_interaction_is_handled() -> None:
+    interaction = decode_interaction(json.dumps({**payload, "data": {"id": "1", "name": "ping"}}).encode())
+    response = encode_response(await handle_interaction(interaction))
+
+    assert json.loads(response.body) == immediate_reply("Pong!").dict(exclude_unset=True)
+    assert (
+        json.loads(encode_response(immediate_reply("Hidden", ephemeral=True)).body)["data"]["flags"] == EPHEMERAL_FLAG
+    )
+    assert json.loads(encode_response(deferred_reply()).body) == {"type": 5}
+    assert json.loads(encode_response(autocomplete_reply([])).body)["data"]["choices"] == []
+
+
+def test_dumps_without_orjson(monkeypatch: pytest.MonkeyPatch) -> None:
+    encoded = codec.dumps({"type": InteractionType.PING, "data": None})
+    monkeypatch.setattr(codec, "orjson", None)
+
+    assert codec.dumps({"type": InteractionType.PING, "data": None}) == encoded
+    assert codec.loads(encoded) == {"type": 1, "data": None}
@@ -1,5 +1,7 @@
+import asyncio
 import random
 from datetime import datetime
+from typing import Any
 from unittest import mock
 
 import pytest
@@ -7,19 +9,23 @@ from d20 import RollSyntaxError
 from fastapi import HTTPException
 from freezegun import freeze_time
 from pytest_httpx import HTTPXMock
-from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED
 
+from SvenBot import a3sync, archub, codec, interactions, utility
+from SvenBot.codec import FastInteraction
 from SvenBot.config import (
     ARCHUB_API,
     ARCHUB_HEADERS,
     GITHUB_HEADERS,
     GUILD_URL,
     HUB_URL,
+    WEBHOOKS_URL,
     settings,
 )
 from SvenBot.main import handle_interaction
-from SvenBot.models import Interaction, InteractionType, Member, Option, OptionType
-from SvenBot.utility import immediate_reply
+from SvenBot.messages import MESSAGE_LIMIT
+from SvenBot.models import Choice, Interaction, InteractionType, Member, Option, OptionType, ResponseData
+from SvenBot.utility import autocomplete_reply, deferred_reply, immediate_reply
 
 
 class Role(dict):
@@ -45,6 +51,22 @@ class MockRequest(dict):
         )
 
 
+@pytest.fixture(autouse=True, params=["model", "codec"])
+def interaction_decoding(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Run every test with interactions as the pydantic model and as decoded from the wire by the fast codec."""
+    if request.param == "model":
+        return
+
+    model = Interaction
+
+    def fast_interaction(**payload: Any) -> FastInteraction:
+        interaction = codec.decode_interaction(model(**payload).json().encode())
+        assert isinstance(interaction, FastInteraction)
+        return interaction
+
+    monkeypatch.setitem(globals(), "Interaction", fast_interaction)
+
+
 bot_role = Role("SvenBotRoleId", "SvenBot", 3, bot_id=settings.CLIENT_ID)
 invalid_role = Role("RoleId789", "invalid_role", 1, color=10)
 normal_role = Role("RoleId456", "normal_role", 2)
@@ -134,6 +156,52 @@ async def test_roles(httpx_mock: HTTPXMock) -> None:
     assert reply == immediate_reply("```\n{}\n```".format(normal_role["name"]), mentions=[])
 
 
+@pytest.mark.asyncio
+async def test_roles_cached(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=roles,
+        status_code=HTTP_200_OK,
+    )
+
+    for _ in range(3):
+        interaction = Interaction(**MockRequest("roles", member_with_role))
+        reply = await handle_interaction(interaction)
+        assert reply == immediate_reply("```\n{}\n```".format(normal_role["name"]), mentions=[])
+
+    assert len(httpx_mock.get_requests(method="GET")) == 1
+
+
+@pytest.mark.asyncio
+async def test_roles_stale_refresh(httpx_mock: HTTPXMock) -> None:
+    renamed_role = Role(normal_role["id"], "renamed_role", 2)
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=roles,
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=[bot_role, renamed_role, invalid_role],
+        status_code=HTTP_200_OK,
+    )
+
+    interaction = Interaction(**MockRequest("roles", member_with_role))
+    await handle_interaction(interaction)
+
+    with mock.patch.object(utility.role_cache, "ttl", 0):
+        reply = await handle_interaction(interaction)
+        assert reply == immediate_reply("```\n{}\n```".format(normal_role["name"]), mentions=[])
+
+        await asyncio.gather(*utility.role_cache._refreshes)  # noqa: SLF001
+
+    reply = await handle_interaction(interaction)
+    assert reply == immediate_reply("```\n{}\n```".format(renamed_role["name"]), mentions=[])
+
+
 @pytest.mark.asyncio
 async def test_roles_no_bot_role(httpx_mock: HTTPXMock) -> None:
     httpx_mock.add_response(
@@ -154,7 +222,7 @@ async def test_members(httpx_mock: HTTPXMock) -> None:
 
     httpx_mock.add_response(
         method="GET",
-        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=200",
+        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=1000",
         json=[member_with_role.dict()],
         status_code=HTTP_200_OK,
     )
@@ -168,6 +236,106 @@ async def test_members(httpx_mock: HTTPXMock) -> None:
     assert reply == immediate_reply(f"```\n{username}\n```", mentions=[])
 
 
+@pytest.mark.asyncio
+async def test_members_paginated(httpx_mock: HTTPXMock) -> None:
+    role_id = normal_role["id"]
+
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=1",
+        json=[member_with_role.dict()],
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=1&after={member_with_role.user.id}",
+        json=[member_no_role.dict()],
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=1&after={member_no_role.user.id}",
+        json=[],
+        status_code=HTTP_200_OK,
+    )
+
+    interaction = Interaction(
+        **MockRequest("members", member_no_role, options=[Option(value=role_id, name="role", type=OptionType.ROLE)]),
+    )
+    with mock.patch.object(utility, "MEMBER_PAGE_SIZE", 1):
+        reply = await handle_interaction(interaction)
+        await handle_interaction(interaction)
+
+    username = member_with_role.user.username
+    assert reply == immediate_reply(f"```\n{username}\n```", mentions=[])
+    cursors = [request.url.params.get("after") for request in httpx_mock.get_requests()]
+    assert cursors == [None, member_with_role.user.id, member_no_role.user.id]
+
+
+@pytest.mark.asyncio
+async def test_members_follow_up(httpx_mock: HTTPXMock) -> None:
+    role_id = normal_role["id"]
+    members = [
+        Member(user={"id": f"User{i}", "username": f"LongUsername{i:04}", "discriminator": "1"}, roles=[role_id])
+        for i in range(200)
+    ]
+
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=1000",
+        json=[member.dict() for member in members],
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="POST",
+        url=f"{WEBHOOKS_URL}/MockAppId/MockToken",
+        status_code=HTTP_200_OK,
+    )
+
+    interaction = Interaction(
+        **MockRequest("members", member_no_role, options=[Option(value=role_id, name="role", type=OptionType.ROLE)]),
+    )
+    reply = await handle_interaction(interaction)
+    await asyncio.gather(*utility.background_tasks)
+
+    follow_up = ResponseData.parse_raw(httpx_mock.get_request(method="POST").content)
+    assert len(reply.data.content) <= MESSAGE_LIMIT
+    assert reply.data.content.startswith("```\nLongUsername0000\n")
+    assert follow_up.content.endswith("LongUsername0199\n```")
+
+
+@pytest.mark.asyncio
+async def test_role_updates_member_index(httpx_mock: HTTPXMock) -> None:
+    role_id = normal_role["id"]
+    user_id = member_no_role.user.id
+
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/members?limit=1000",
+        json=[member_with_role.dict(), member_no_role.dict()],
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=roles,
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="PUT",
+        url=f"{GUILD_URL}/{arcomm_guild}/members/{user_id}/roles/{role_id}",
+        status_code=HTTP_204_NO_CONTENT,
+    )
+
+    options = [Option(value=role_id, name="role", type=OptionType.ROLE)]
+    await handle_interaction(Interaction(**MockRequest("members", member_no_role, options=options)))
+    await handle_interaction(Interaction(**MockRequest("role", member_no_role, options=options)))
+    reply = await handle_interaction(Interaction(**MockRequest("members", member_no_role, options=options)))
+
+    usernames = [member_with_role.user.username, member_no_role.user.username]
+    assert reply == immediate_reply("```\n{}\n```".format("\n".join(usernames)), mentions=[])
+
+
 @pytest.mark.asyncio
 async def test_myroles() -> None:
     interaction = Interaction(**MockRequest("myroles", member_with_role))
@@ -176,6 +344,20 @@ async def test_myroles() -> None:
     assert reply == immediate_reply("<@&{}>\n".format(normal_role["id"]), mentions=[], ephemeral=True)
 
 
+@pytest.mark.asyncio
+async def test_myroles_followups_are_ephemeral(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(method="POST", url=f"{WEBHOOKS_URL}/MockAppId/MockToken", status_code=HTTP_200_OK)
+    member = Member(user=member_with_role.user, roles=[f"{i:018}" for i in range(200)])
+
+    reply = await handle_interaction(Interaction(**MockRequest("myroles", member)))
+    await asyncio.gather(*utility.background_tasks)
+
+    follow_ups = [ResponseData.parse_raw(request.content) for request in httpx_mock.get_requests(method="POST")]
+    assert reply.data.flags == utility.EPHEMERAL_FLAG
+    assert follow_ups
+    assert all(follow_up.flags == utility.EPHEMERAL_FLAG for follow_up in follow_ups)
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     ("now_mock", "modifier", "time_until_optime"),
@@ -233,6 +415,36 @@ async def test_addrole(httpx_mock: HTTPXMock, role_name: str, role_id: str, send
     assert reply == immediate_reply(f"<@&{role_id}> {reply_type}", mentions=[])
 
 
+@pytest.mark.asyncio
+async def test_addrole_invalidates_roles(httpx_mock: HTTPXMock) -> None:
+    new_role = Role("NewRoleId", "NewRole", 1)
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=roles,
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="POST",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=new_role,
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=[*roles, new_role],
+        status_code=HTTP_200_OK,
+    )
+
+    options = [Option(value=new_role["name"], name="name", type=OptionType.STRING)]
+    await handle_interaction(Interaction(**MockRequest("addrole", member_no_role, options=options)))
+    reply = await handle_interaction(Interaction(**MockRequest("roles", member_no_role)))
+
+    assert reply == immediate_reply("```\n{}\n{}\n```".format(new_role["name"], normal_role["name"]), mentions=[])
+    assert [request.method for request in httpx_mock.get_requests()] == ["GET", "POST", "GET"]
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     ("httpx_mock", "role", "sends_delete", "reply_type"),
@@ -407,6 +619,34 @@ async def test_renamerole(httpx_mock: HTTPXMock, role: Role, new_name: str, patc
         assert reply == immediate_reply(f"<@&{role_id}> {reply_type}", mentions=[])
 
 
+@pytest.mark.asyncio
+async def test_modchanges() -> None:
+    a3sync.store_revisions(
+        [
+            {"revision": 1, "newAddons": ["@old"], "deletedAddons": [], "updatedAddons": []},
+            {"revision": 2, "newAddons": [], "deletedAddons": [], "updatedAddons": ["@cba"]},
+            {"revision": 3, "newAddons": ["@new"], "deletedAddons": ["@gone"], "updatedAddons": []},
+        ],
+    )
+
+    latest = await handle_interaction(Interaction(**MockRequest("modchanges", member_no_role)))
+    since = await handle_interaction(
+        Interaction(
+            **MockRequest(
+                "modchanges",
+                member_no_role,
+                options=[
+                    Option(name="since", type=OptionType.INTEGER, value=1),
+                    Option(name="until", type=OptionType.INTEGER, value=2),
+                ],
+            ),
+        ),
+    )
+
+    assert latest == immediate_reply("```md\n# Revision 3 #\n< New >\n@new\n< Deleted >\n@gone\n```")
+    assert since == immediate_reply("```md\n# Revision 2 #\n< Updated >\n@cba\n```")
+
+
 @pytest.mark.asyncio
 async def test_maps(httpx_mock: HTTPXMock) -> None:
     maps = [{"class_name": "map1class", "display_name": "map1display"}]
@@ -425,6 +665,92 @@ async def test_maps(httpx_mock: HTTPXMock) -> None:
     assert reply == immediate_reply(out_string, mentions=[])
 
 
+@pytest.mark.asyncio
+async def test_maps_conditional_request(httpx_mock: HTTPXMock) -> None:
+    maps = [{"class_name": "map1class", "display_name": "map1class"}]
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{ARCHUB_API}/maps",
+        json=maps,
+        headers={"ETag": '"v1"'},
+        status_code=HTTP_200_OK,
+        match_headers=ARCHUB_HEADERS,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{ARCHUB_API}/maps",
+        status_code=HTTP_304_NOT_MODIFIED,
+        match_headers={**ARCHUB_HEADERS, "If-None-Match": '"v1"'},
+    )
+
+    interaction = Interaction(**MockRequest("maps", member_no_role, options=[]))
+    first = await handle_interaction(interaction)
+    await handle_interaction(interaction)
+    with mock.patch.object(archub.response_cache, "ttl", 0):
+        second = await handle_interaction(interaction)
+
+    assert first == second
+    assert len(httpx_mock.get_requests()) == len(["200", "304"])
+
+
+@pytest.mark.asyncio
+async def test_renamemap_invalidates_maps(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{ARCHUB_API}/maps",
+        json=[{"class_name": "abc", "display_name": "abc"}],
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="PATCH",
+        url=f"{ARCHUB_API}/maps?old_name=abc&new_name=def",
+        status_code=HTTP_204_NO_CONTENT,
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{ARCHUB_API}/maps",
+        json=[{"class_name": "def", "display_name": "def"}],
+        status_code=HTTP_200_OK,
+    )
+
+    options = [
+        Option(value="abc", name="old_name", type=OptionType.STRING),
+        Option(value="def", name="new_name", type=OptionType.STRING),
+    ]
+    await handle_interaction(Interaction(**MockRequest("maps", member_no_role, options=[])))
+    await handle_interaction(Interaction(**MockRequest("renamemap", member_no_role, options=options)))
+    reply = await handle_interaction(Interaction(**MockRequest("maps", member_no_role, options=[])))
+
+    assert reply.data.content.endswith("\ndef\n```")
+
+
+@pytest.mark.asyncio
+async def test_deferred_reply(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(
+        method="PATCH",
+        url=f"{WEBHOOKS_URL}/MockAppId/MockToken/messages/@original",
+        status_code=HTTP_200_OK,
+    )
+
+    async def execute_slow(interaction: Interaction) -> str:  # noqa: ARG001
+        await asyncio.sleep(0.05)
+        return "Done"
+
+    interaction = Interaction(**MockRequest("ping", member_no_role))
+    with (
+        mock.patch.dict(interactions.execute_map, {"ping": execute_slow}),
+        mock.patch.dict(interactions.response_budgets, {"ping": 0.01}),
+    ):
+        reply = await handle_interaction(interaction)
+    assert reply == deferred_reply()
+
+    await asyncio.gather(*utility.background_tasks)
+    assert (
+        httpx_mock.get_request(method="PATCH").content.decode()
+        == ResponseData(content="Done", allowed_mentions={"parse": []}).json()
+    )
+
+
 @pytest.mark.asyncio
 async def test_renamemap(httpx_mock: HTTPXMock) -> None:
     old_name, new_name = "abc", "def"
@@ -450,5 +776,49 @@ async def test_renamemap(httpx_mock: HTTPXMock) -> None:
     assert reply == immediate_reply(f"`{old_name}` was renamed to `{new_name}`", mentions=[])
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(("httpx_mock", "query"), [(None, "NOR"), (None, "")], indirect=["httpx_mock"])
+async def test_autocomplete_joinable_role(httpx_mock: HTTPXMock, query: str) -> None:
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=roles,
+        status_code=HTTP_200_OK,
+    )
+
+    options = [Option(value=query, name="role", type=OptionType.STRING, focused=True)]
+    request = MockRequest("role", member_no_role, options=options)
+    request["type"] = InteractionType.APPLICATION_COMMAND_AUTOCOMPLETE
+    reply = await handle_interaction(Interaction(**request))
+
+    # The bot's own role and restricted roles are never suggested
+    assert reply == autocomplete_reply([Choice(name=normal_role["name"], value=normal_role["id"])])
+
+
+@pytest.mark.asyncio
+async def test_role_by_name(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{GUILD_URL}/{arcomm_guild}/roles",
+        json=roles,
+        status_code=HTTP_200_OK,
+    )
+    httpx_mock.add_response(
+        method="PUT",
+        url=f"{GUILD_URL}/{arcomm_guild}/members/User234/roles/{normal_role['id']}",
+        status_code=HTTP_204_NO_CONTENT,
+    )
+
+    options = [Option(value="NORMAL_ROLE", name="role", type=OptionType.STRING)]
+    reply = await handle_interaction(Interaction(**MockRequest("role", member_no_role, options=options)))
+    assert reply == immediate_reply(f"You've joined <@&{normal_role['id']}>", mentions=[])
+
+    # Only a whole name counts, a prefix could just as well be the start of a role the member didn't mean
+    for value in ("norm", "xyz"):
+        options = [Option(value=value, name="role", type=OptionType.STRING)]
+        reply = await handle_interaction(Interaction(**MockRequest("role", member_no_role, options=options)))
+        assert reply == immediate_reply(f"No role matches '{value}'", mentions=[])
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from SvenBot.config import settings
+from SvenBot.leader import Leadership
+
+
+def test_only_one_leader() -> None:
+    first, second = Leadership("leader.lock"), Leadership("leader.lock")
+
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    assert not second.is_leader
+
+    first.release()
+
+    assert second.try_acquire()
+    assert second.is_leader
+    second.release()
+
+
+@pytest.mark.asyncio
+async def test_follower_takes_over(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "LEADER_ELECTION_INTERVAL", 0.01)
+    leader, follower = Leadership("leader.lock"), Leadership("leader.lock")
+    elected = asyncio.Event()
+
+    async def on_elected() -> None:
+        elected.set()
+
+    assert leader.try_acquire()
+    follower.start(on_elected)
+    await asyncio.sleep(0.05)
+    assert not elected.is_set()
+
+    # The leader going away, however it happens, frees the lock
+    await leader.stop()
+    await asyncio.wait_for(elected.wait(), 1)
+    assert follower.is_leader
+
+    await follower.stop()
+    assert not follower.is_leader
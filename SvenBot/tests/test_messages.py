@@ -0,0 +1,84 @@
+import pytest
+from pytest_httpx import HTTPXMock
+
+from SvenBot.config import CHANNELS_URL
+from SvenBot.messages import (
+    EMBED_COUNT_LIMIT,
+    EMBED_TOTAL_LIMIT,
+    MESSAGE_LIMIT,
+    build_messages,
+    group_embeds,
+    split_text,
+)
+from SvenBot.models import Embed
+from SvenBot.outbox import outbox
+
+
+def test_split_text_fits() -> None:
+    assert split_text("Hello") == ["Hello"]
+
+
+def test_split_text_between_lines() -> None:
+    parts = split_text("aaaa\nbbbb\ncccc\n", limit=14)
+
+    assert parts == ["aaaa\nbbbb\n", "cccc\n"]
+
+
+def test_split_text_reopens_code_blocks() -> None:
+    text = "Header\n```md\n< New >\n@mod_one\n@mod_two\n```\nFooter\n"
+    parts = split_text(text, limit=30)
+
+    assert parts == ["Header\n```md\n< New >\n```", "```md\n@mod_one\n@mod_two\n```\n", "Footer\n"]
+    assert all(len(part) <= 30 for part in parts)  # noqa: PLR2004
+    assert all(part.count("```") % 2 == 0 for part in parts)
+
+
+def test_split_text_long_line() -> None:
+    parts = split_text("```\n" + "x" * 25 + "\n```", limit=20)
+
+    assert all(len(part) <= 20 for part in parts)  # noqa: PLR2004
+    assert all(part.startswith("```\n") for part in parts)
+    assert "".join(part.removeprefix("```\n").removesuffix("```") for part in parts).replace("\n", "") == "x" * 25
+
+
+def test_split_text_never_leaves_empty_code_blocks() -> None:
+    # The fence moves on with the line that doesn't fit, rather than ending a part with nothing inside it
+    assert split_text("Header\n```md\n" + "y" * 20 + "\n```", limit=20) == [
+        "Header\n",
+        "```md\n" + "y" * 10 + "\n```",
+        "```md\n" + "y" * 10 + "\n```",
+    ]
+
+    parts = split_text("```\n" + "y" * 50 + "\n```", limit=20)
+    assert all(len(part) <= 20 for part in parts)  # noqa: PLR2004
+    assert all(part.strip("`\n") for part in parts)
+
+
+def test_group_embeds() -> None:
+    small = [Embed(title=f"{i}", description="") for i in range(EMBED_COUNT_LIMIT + 1)]
+    large = [Embed(title="", description="x" * (EMBED_TOTAL_LIMIT // 2)) for _ in range(3)]
+
+    assert [len(group) for group in group_embeds(small)] == [EMBED_COUNT_LIMIT, 1]
+    assert [len(group) for group in group_embeds(large)] == [2, 1]
+
+
+def test_build_messages() -> None:
+    embeds = [Embed(title=f"{i}", description="") for i in range(EMBED_COUNT_LIMIT + 1)]
+    messages = build_messages("x" * (MESSAGE_LIMIT - 10) + "\n" + "y" * 20, ["roles"], embeds)
+
+    assert [message.content for message in messages] == ["x" * (MESSAGE_LIMIT - 10) + "\n", "y" * 20, None]
+    assert [len(message.embeds or []) for message in messages] == [0, EMBED_COUNT_LIMIT, 1]
+    assert all(message.allowed_mentions == {"parse": ["roles"]} for message in messages)
+
+
+@pytest.mark.asyncio
+async def test_send_message_in_parts(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(method="POST", url=f"{CHANNELS_URL}/1/messages")
+
+    text = "\n".join(["line"] * MESSAGE_LIMIT)
+    messages = await outbox.enqueue(1, text)
+    await outbox.drain()
+
+    assert len(httpx_mock.get_requests()) == len(messages)
+    assert all(len(message.content) <= MESSAGE_LIMIT for message in messages)
+    assert "".join(message.content for message in messages) == text
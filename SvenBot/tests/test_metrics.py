@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from pytest_httpx import HTTPXMock
+from sqlalchemy import select
+from starlette.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND, HTTP_503_SERVICE_UNAVAILABLE
+
+from SvenBot import metrics, utility
+from SvenBot.config import ARCHUB_API, settings
+from SvenBot.database import MetricsSnapshot, database
+from SvenBot.main import app, handle_interaction
+from SvenBot.metrics import (
+    RETIRED_ID,
+    WORKER_ID,
+    MetricsRegistry,
+    render_all_workers,
+    retire_worker,
+    store_snapshot,
+    timed_task,
+)
+from SvenBot.models import Interaction, InteractionType
+
+client = TestClient(app)
+
+
+def test_histogram_render() -> None:
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test histogram", ("name",), (0.1, 1.0))
+    histogram.observe(0.05, 'a"b')
+    histogram.observe(0.5, 'a"b')
+    histogram.observe(5, 'a"b')
+
+    assert registry.render().splitlines() == [
+        "# HELP test_seconds Test histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{name="a\\"b",le="0.1"} 1',
+        'test_seconds_bucket{name="a\\"b",le="1.0"} 2',
+        'test_seconds_bucket{name="a\\"b",le="+Inf"} 3',
+        'test_seconds_sum{name="a\\"b"} 5.55',
+        'test_seconds_count{name="a\\"b"} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_command_and_upstream_metrics(httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch) -> None:
+    httpx_mock.add_response(url=f"{ARCHUB_API}/maps", status_code=HTTP_503_SERVICE_UNAVAILABLE)
+    httpx_mock.add_response(url=f"{ARCHUB_API}/maps", status_code=HTTP_200_OK)
+    interaction = Interaction(
+        id="MockRequestId",
+        application_id="MockAppId",
+        type=InteractionType.APPLICATION_COMMAND,
+        token="MockToken",
+        version=1,
+        data={"id": "1", "name": "ping"},
+        member={"user": {"id": "1", "username": "TestUser", "discriminator": "1"}, "roles": [], "permissions": "0"},
+    )
+
+    await handle_interaction(interaction)
+    await utility.get([HTTP_200_OK], f"{ARCHUB_API}/maps")
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "metricstoken")
+    rendered = client.get("/metrics", headers={"Authorization": "Bearer metricstoken"}).text.splitlines()
+    assert 'svenbot_command_duration_seconds_count{command="ping",outcome="ok"} 1' in rendered
+    assert 'svenbot_upstream_request_duration_seconds_count{upstream="archub",method="GET",status="200"} 1' in rendered
+    assert 'svenbot_upstream_retries_total{upstream="archub"} 1' in rendered
+    assert 'svenbot_upstream_requests{upstream="archub"} 2' in rendered
+    assert 'svenbot_upstream_breaker_state{upstream="archub",state="closed"} 1.0' in rendered
+    assert 'svenbot_upstream_breaker_state{upstream="archub",state="open"} 0.0' in rendered
+    assert 'svenbot_upstream_breaker_failures{upstream="archub"} 0' in rendered
+    assert 'svenbot_upstream_breaker_trips{upstream="archub"} 0' in rendered
+
+
+@pytest.mark.asyncio
+async def test_timed_task() -> None:
+    async def failing_task() -> None:
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        await timed_task(failing_task)()
+
+    assert 'svenbot_task_duration_seconds_count{task="failing_task",outcome="error"} 1' in (
+        metrics.registry.render().splitlines()
+    )
+
+
+def test_metrics_require_token(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert client.get("/metrics").status_code == HTTP_404_NOT_FOUND
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "metricstoken")
+
+    assert client.get("/metrics").status_code == HTTP_401_UNAUTHORIZED
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_metrics_merge_workers() -> None:
+    # Another worker's snapshot, one still running and one long gone
+    other = {
+        "svenbot_upstream_retries_total": [[["archub"], 2]],
+        "svenbot_upstream_max_pool_wait": [[["archub"], 0.5]],
+    }
+    await asyncio.to_thread(store_snapshot, "other", other, time.time())
+    await asyncio.to_thread(store_snapshot, "gone", other, 0)
+    metrics.upstream_retries.inc("archub")
+
+    rendered = (await render_all_workers(settings.METRICS_PUBLISH_INTERVAL)).splitlines()
+
+    assert 'svenbot_upstream_retries_total{upstream="archub"} 5' in rendered
+    assert 'svenbot_upstream_max_pool_wait{upstream="archub"} 0.5' in rendered
+
+    # The gone worker's counts are folded into the retired row, and this worker's are once it stops too
+    await asyncio.to_thread(retire_worker, WORKER_ID, metrics.registry.snapshot())
+    with database.session() as session:
+        assert sorted(session.execute(select(MetricsSnapshot.worker_id)).scalars()) == ["other", RETIRED_ID]
+        retired = session.get(MetricsSnapshot, RETIRED_ID).families
+    assert retired["svenbot_upstream_retries_total"] == [[["archub"], 3]]
+    assert retired["svenbot_upstream_max_pool_wait"] == []
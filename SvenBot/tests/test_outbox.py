@@ -0,0 +1,66 @@
+import json
+from collections.abc import Callable
+
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+from starlette.status import HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR
+
+from SvenBot.config import CHANNELS_URL, settings
+from SvenBot.database import OutboxMessage, database
+from SvenBot.outbox import OutboxStatus, outbox
+
+
+def failing_first(failures: int, sent: list[str]) -> Callable[[httpx.Request], httpx.Response]:
+    def respond(request: httpx.Request) -> httpx.Response:
+        sent.append(json.loads(request.content)["content"])
+        if len(sent) <= failures:
+            return httpx.Response(HTTP_500_INTERNAL_SERVER_ERROR)
+        return httpx.Response(HTTP_200_OK)
+
+    return respond
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_in_order(httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch) -> None:
+    sent: list[str] = []
+    httpx_mock.add_callback(failing_first(1, sent), method="POST", url=f"{CHANNELS_URL}/1/messages")
+    httpx_mock.add_response(method="POST", url=f"{CHANNELS_URL}/2/messages")
+
+    await outbox.enqueue(1, "first")
+    await outbox.enqueue(1, "second")
+    await outbox.enqueue(2, "other")
+
+    # The failed message holds back the rest of its channel, but not other channels
+    assert await outbox.drain() == pytest.approx(settings.OUTBOX_RETRY_DELAY, abs=1)
+    assert sent == ["first"]
+    assert len(httpx_mock.get_requests(url=f"{CHANNELS_URL}/2/messages")) == 1
+
+    monkeypatch.setattr(settings, "OUTBOX_RETRY_DELAY", 0)
+    with database.session() as session, session.begin():
+        session.get(OutboxMessage, 1).next_attempt_at = 0
+
+    assert await outbox.drain() is None
+    assert sent == ["first", "first", "second"]
+
+
+@pytest.mark.asyncio
+async def test_outbox_gives_up(httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "OUTBOX_RETRY_DELAY", 0)
+    monkeypatch.setattr(settings, "OUTBOX_MAX_ATTEMPTS", 2)
+    sent: list[str] = []
+    httpx_mock.add_callback(failing_first(2, sent), method="POST", url=f"{CHANNELS_URL}/1/messages")
+
+    await outbox.enqueue(1, "first")
+    await outbox.enqueue(1, "second")
+
+    assert await outbox.drain() is None
+    assert sent == ["first", "first", "second"]
+    with database.session() as session:
+        failed = session.get(OutboxMessage, 1)
+        assert [failed.status, failed.attempts] == [OutboxStatus.FAILED.value, 2]
+
+    monkeypatch.setattr(settings, "OUTBOX_FAILED_RETENTION", -1)
+    await outbox.drain()
+    with database.session() as session:
+        assert session.get(OutboxMessage, 1) is None
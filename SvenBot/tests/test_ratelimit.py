@@ -0,0 +1,92 @@
+import time
+
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+from starlette.status import HTTP_200_OK, HTTP_429_TOO_MANY_REQUESTS
+
+from SvenBot import utility
+from SvenBot.config import CHANNELS_URL, GUILD_URL, WEBHOOKS_URL
+from SvenBot.ratelimit import route_key
+
+guild_id = "342006395010547712"
+
+
+def test_route_key() -> None:
+    route, major = route_key("PUT", httpx.URL(f"{GUILD_URL}/{guild_id}/members/123/roles/456"))
+
+    assert route == f"PUT /api/v8/guilds/{guild_id}/members/:id/roles/:id"
+    assert major == guild_id
+
+    route, major = route_key("PATCH", httpx.URL(f"{WEBHOOKS_URL}/123/aW50ZXJhY3Rpb24/messages/@original"))
+
+    assert route == "PATCH /api/v8/webhooks/123/:token/messages/@original"
+    assert major == "123/aW50ZXJhY3Rpb24"
+
+
+@pytest.mark.asyncio
+async def test_prunes_idle_buckets(httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch) -> None:
+    for token in ("first", "second"):
+        httpx_mock.add_response(method="PATCH", url=f"{WEBHOOKS_URL}/123/{token}/messages/@original")
+        await utility.patch([HTTP_200_OK], f"{WEBHOOKS_URL}/123/{token}/messages/@original")
+    assert len(utility.rate_limiter._buckets) == len(["first", "second"])  # noqa: SLF001
+
+    monkeypatch.setattr(utility.rate_limiter, "_next_prune", 0)
+    httpx_mock.add_response(method="PATCH", url=f"{WEBHOOKS_URL}/123/third/messages/@original")
+    await utility.patch([HTTP_200_OK], f"{WEBHOOKS_URL}/123/third/messages/@original")
+
+    assert len(utility.rate_limiter._buckets) == 1  # noqa: SLF001
+
+
+@pytest.mark.asyncio
+async def test_retries_429(httpx_mock: HTTPXMock) -> None:
+    url = f"{CHANNELS_URL}/123/messages"
+    httpx_mock.add_response(
+        method="POST",
+        url=url,
+        json={"retry_after": 0.05, "global": False},
+        status_code=HTTP_429_TOO_MANY_REQUESTS,
+    )
+    httpx_mock.add_response(method="POST", url=url, status_code=HTTP_200_OK)
+
+    start = time.monotonic()
+    r = await utility.post([HTTP_200_OK], url)
+
+    assert r.status_code == HTTP_200_OK
+    assert time.monotonic() - start >= 0.05  # noqa: PLR2004
+    assert utility.rate_limiter.stats.rate_limited == 1
+
+
+@pytest.mark.asyncio
+async def test_waits_for_exhausted_bucket(httpx_mock: HTTPXMock) -> None:
+    url = f"{GUILD_URL}/{guild_id}/roles"
+    httpx_mock.add_response(
+        method="GET",
+        url=url,
+        json=[],
+        headers={"X-RateLimit-Bucket": "abc", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": "0.05"},
+        status_code=HTTP_200_OK,
+    )
+
+    await utility.get([HTTP_200_OK], url)
+    await utility.get([HTTP_200_OK], url)
+
+    assert utility.rate_limiter.stats.queued_requests == 1
+    assert utility.rate_limiter.stats.queued_seconds > 0
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_retries(httpx_mock: HTTPXMock) -> None:
+    url = f"{CHANNELS_URL}/123/messages"
+    httpx_mock.add_response(
+        method="POST",
+        url=url,
+        json={"retry_after": 0, "global": True},
+        headers={"X-RateLimit-Global": "true"},
+        status_code=HTTP_429_TOO_MANY_REQUESTS,
+    )
+
+    with pytest.raises(RuntimeError):
+        await utility.post([HTTP_200_OK], url)
+
+    assert utility.rate_limiter.stats.rate_limited == utility.rate_limiter.max_retries + 1
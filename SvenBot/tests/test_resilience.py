@@ -0,0 +1,96 @@
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+from starlette.status import HTTP_200_OK, HTTP_503_SERVICE_UNAVAILABLE
+
+from SvenBot import utility
+from SvenBot.clients import registry
+from SvenBot.config import ARCHUB_API, ARCHUB_HEADERS, REPO_URL
+from SvenBot.main import handle_interaction
+from SvenBot.models import Interaction
+from SvenBot.resilience import BreakerState, CircuitBreaker, RetryPolicy, UpstreamUnavailableError
+from SvenBot.tests.test_interactions import MockRequest, member_no_role
+
+no_delay = RetryPolicy(max_attempts=10, base_delay=0)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    for upstream in registry:
+        monkeypatch.setattr(upstream, "retry", no_delay)
+
+
+@pytest.mark.asyncio
+async def test_retries_idempotent(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(method="GET", url=f"{REPO_URL}/repo", status_code=HTTP_503_SERVICE_UNAVAILABLE)
+    httpx_mock.add_response(method="GET", url=f"{REPO_URL}/repo", status_code=HTTP_200_OK, json={"revision": 1})
+
+    r = await utility.get([HTTP_200_OK], f"{REPO_URL}/repo")
+
+    assert r.json() == {"revision": 1}
+    assert len(httpx_mock.get_requests()) == len(["503", "200"])
+
+
+@pytest.mark.asyncio
+async def test_retries_transport_errors(httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch) -> None:
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    monkeypatch.setattr(registry.for_url(httpx.URL(REPO_URL)), "retry", policy)
+    httpx_mock.add_exception(httpx.ConnectTimeout("timed out"), method="GET", url=f"{REPO_URL}/repo")
+
+    with pytest.raises(httpx.ConnectTimeout):
+        await utility.get([HTTP_200_OK], f"{REPO_URL}/repo")
+
+    assert len(httpx_mock.get_requests()) == policy.max_attempts
+
+
+@pytest.mark.asyncio
+async def test_does_not_retry_post(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(method="POST", url=f"{REPO_URL}/repo", status_code=HTTP_503_SERVICE_UNAVAILABLE)
+
+    with pytest.raises(RuntimeError):
+        await utility.post([HTTP_200_OK], f"{REPO_URL}/repo")
+
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_breaker_half_open(monkeypatch: pytest.MonkeyPatch) -> None:
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == BreakerState.OPEN
+
+    breaker.before_request()
+    assert breaker.state == BreakerState.HALF_OPEN
+
+    monkeypatch.setattr(breaker, "reset_timeout", 30)
+    with pytest.raises(UpstreamUnavailableError):
+        breaker.before_request()
+
+    breaker.record_success()
+    assert breaker.state == BreakerState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_fails_fast(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{ARCHUB_API}/maps",
+        status_code=HTTP_503_SERVICE_UNAVAILABLE,
+        match_headers=ARCHUB_HEADERS,
+    )
+
+    archub = registry.for_url(httpx.URL(ARCHUB_API))
+    interaction = Interaction(**MockRequest("maps", member_no_role, options=[]))
+    reply = await handle_interaction(interaction)
+
+    assert archub.breaker.state == BreakerState.OPEN
+    assert len(httpx_mock.get_requests()) == archub.breaker.failure_threshold
+
+    reply = await handle_interaction(interaction)
+
+    assert reply == utility.immediate_reply(
+        "Can't reach archub right now, please try again in a minute", ephemeral=True
+    )
+    assert len(httpx_mock.get_requests()) == archub.breaker.failure_threshold
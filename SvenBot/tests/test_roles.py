@@ -0,0 +1,57 @@
+import pytest
+
+from SvenBot.roles import RoleIndex
+from SvenBot.utility import basic_validation, colour_validation
+
+bot_id = "BotId"
+bot_role = {"id": "BotRoleId", "name": "SvenBot", "position": 50, "color": 0, "tags": {"bot_id": bot_id}}
+other_bot_role = {"id": "OtherBotRoleId", "name": "OtherBot", "position": 2, "color": 0, "tags": {"bot_id": "Other"}}
+above_bot_role = {"id": "AboveRoleId", "name": "Admin", "position": 60, "color": 0}
+coloured_role = {"id": "ColouredRoleId", "name": "Coloured", "position": 3, "color": 10}
+roles = [
+    bot_role,
+    other_bot_role,
+    above_bot_role,
+    coloured_role,
+    *({"id": f"RoleId{i}", "name": f"Role {i:02}", "position": 4 + i, "color": 0} for i in range(40)),
+]
+
+
+def test_role_index_lookups() -> None:
+    index = RoleIndex(roles, bot_id, colour_validation)
+
+    assert index.bot_position == bot_role["position"]
+    assert index.by_id["RoleId7"]["name"] == "Role 07"
+    assert index.by_name["role 07"]["id"] == "RoleId7"
+
+
+def test_role_index_joinable() -> None:
+    index = RoleIndex(roles, bot_id, colour_validation)
+
+    assert index.joinable_names() == [f"Role {i:02}" for i in range(40)]
+    assert not index.is_valid(above_bot_role)
+    assert not index.is_valid(other_bot_role)
+    assert not index.is_valid(coloured_role)
+
+
+def test_role_index_validator_choice() -> None:
+    assert RoleIndex(roles, bot_id, basic_validation).is_valid(coloured_role)
+    assert not RoleIndex(roles, bot_id, None).is_valid(coloured_role)
+
+
+def test_role_index_no_bot_role() -> None:
+    index = RoleIndex(roles[1:], bot_id, colour_validation)
+
+    with pytest.raises(RuntimeError, match="Unable to find bot's role"):
+        index.joinable_names()
+    with pytest.raises(RuntimeError, match="Unable to find bot's role"):
+        index.is_valid(coloured_role)
+
+
+def test_role_index_prefix_matches() -> None:
+    index = RoleIndex([*roles, {"id": "RoleId", "name": "role", "position": 4, "color": 0}], bot_id, None)
+
+    assert [role["name"] for role in index.prefix_matches("ROLE 1", limit=3)] == ["Role 10", "Role 11", "Role 12"]
+    assert [role["name"] for role in index.prefix_matches("ro", limit=2)] == ["role", "Role 00"]
+    assert index.prefix_matches("missing") == []
+    assert len(index.prefix_matches("")) == 25  # noqa: PLR2004
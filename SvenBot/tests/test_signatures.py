@@ -0,0 +1,66 @@
+import time
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from nacl.signing import SigningKey
+from starlette.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+from SvenBot.main import ValidDiscordRequest
+
+MAX_BODY_SIZE = 64
+TIMESTAMP_WINDOW = 300
+
+signing_key = SigningKey.generate()
+verifier = ValidDiscordRequest(signing_key.verify_key.encode().hex(), MAX_BODY_SIZE, TIMESTAMP_WINDOW)
+
+verified_app = FastAPI()
+
+
+@verified_app.post("/", dependencies=[Depends(verifier)])
+def verified() -> dict[str, bool]:
+    return {"verified": True}
+
+
+client = TestClient(verified_app)
+
+
+def signed_headers(body: str, timestamp: int | None = None) -> dict[str, str]:
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    signature = signing_key.sign(f"{timestamp}{body}".encode()).signature.hex()
+    return {"X-Signature-Timestamp": timestamp, "X-Signature-Ed25519": signature}
+
+
+def test_valid_discord_request() -> None:
+    body = '{"type": 1}'
+    response = client.post("/", data=body, headers=signed_headers(body))
+
+    assert response.status_code == HTTP_200_OK
+
+
+def test_invalid_discord_requests() -> None:
+    body = '{"type": 1}'
+    stale = int(time.time()) - TIMESTAMP_WINDOW - 60
+
+    responses = [
+        client.post("/", data=body),
+        client.post("/", data=body, headers=signed_headers('{"type": 2}')),
+        client.post("/", data=body, headers={**signed_headers(body), "X-Signature-Ed25519": "not hex"}),
+        client.post("/", data=body, headers=signed_headers(body, timestamp=stale)),
+    ]
+
+    assert [response.status_code for response in responses] == [HTTP_401_UNAUTHORIZED] * len(responses)
+
+
+def test_oversized_discord_request() -> None:
+    body = "x" * (MAX_BODY_SIZE + 1)
+    response = client.post("/", data=body, headers=signed_headers(body))
+
+    assert response.status_code == HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+def test_invalid_public_key() -> None:
+    body = '{"type": 1}'
+    invalid = ValidDiscordRequest("00", MAX_BODY_SIZE, TIMESTAMP_WINDOW)
+
+    assert invalid.verify_key is None
+    assert not invalid.verify(body.encode(), signed_headers(body)["X-Signature-Ed25519"], str(int(time.time())))
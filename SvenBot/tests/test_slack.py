@@ -1,8 +1,17 @@
+import hashlib
+import hmac
+import json
+import time
+from unittest import mock
+
+import pytest
 from fastapi.testclient import TestClient
 from pydantic import BaseModel
 from pytest_httpx import HTTPXMock
-from starlette.status import HTTP_200_OK
+from requests import Response
+from starlette.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED
 
+from SvenBot import slack
 from SvenBot.config import (
     ARCHUB_API,
     ARCHUB_HEADERS,
@@ -23,6 +32,7 @@ from SvenBot.models import (
     SlackNotification,
     SlackNotificationType,
 )
+from SvenBot.outbox import outbox
 
 client = TestClient(app)
 
@@ -39,10 +49,11 @@ class ArchubMission(BaseModel):
     thumbnail: str = "/thumb"
 
 
-def mock_calendar_notification(title: str) -> SlackNotification:
+def mock_calendar_notification(title: str, event_id: str | None = None) -> SlackNotification:
     return SlackNotification(
         token="abca",
         type=SlackNotificationType.CALLBACK,
+        event_id=event_id,
         event=SlackEvent(
             type="abc",
             text="abcdef",
@@ -57,7 +68,8 @@ def mock_calendar_notification(title: str) -> SlackNotification:
     )
 
 
-def test_random_event(httpx_mock: HTTPXMock) -> None:
+@pytest.mark.asyncio
+async def test_random_event(httpx_mock: HTTPXMock) -> None:
     httpx_mock.add_response(
         method="POST",
         url=f"{CHANNELS_URL}/{settings.OP_CHANNEL}/messages",
@@ -66,9 +78,9 @@ def test_random_event(httpx_mock: HTTPXMock) -> None:
 
     title = "ARCOMM random kind of event"
     notification = mock_calendar_notification(title)
-    response = client.post("/slack/", json=notification.dict())
+    await slack.process_event(notification.event)
+    await outbox.drain()
 
-    assert response.status_code == HTTP_200_OK
     assert (
         httpx_mock.get_request().content.decode()
         == ResponseData(
@@ -88,7 +100,8 @@ def test_random_event(httpx_mock: HTTPXMock) -> None:
     )
 
 
-def test_main_event(httpx_mock: HTTPXMock) -> None:
+@pytest.mark.asyncio
+async def test_main_event(httpx_mock: HTTPXMock) -> None:
     mission1 = ArchubMission(id=15, display_name="Random COOP", mode="coop", user="MissionMaker1", hasMaintainer=False)
     mission2 = ArchubMission(id=16, display_name="Random TVT", mode="tvt", user="MissionMaker2", hasMaintainer=False)
     mission3 = ArchubMission(id=17, display_name="Random ARCade", mode="ade", user="MissionMaker3", hasMaintainer=True)
@@ -109,9 +122,9 @@ def test_main_event(httpx_mock: HTTPXMock) -> None:
 
     title = "ARCOMM MAIN EVENT"
     notification = mock_calendar_notification(title)
-    response = client.post("/slack/", json=notification.dict())
+    await slack.process_event(notification.event)
+    await outbox.drain()
 
-    assert response.status_code == HTTP_200_OK
     assert (
         httpx_mock.get_request(method="POST").content.decode()
         == ResponseData(
@@ -153,7 +166,8 @@ def test_main_event(httpx_mock: HTTPXMock) -> None:
     )
 
 
-def test_recruit_event(httpx_mock: HTTPXMock) -> None:
+@pytest.mark.asyncio
+async def test_recruit_event(httpx_mock: HTTPXMock) -> None:
     httpx_mock.add_response(
         method="POST",
         url=f"{CHANNELS_URL}/{settings.OP_CHANNEL}/messages",
@@ -162,9 +176,9 @@ def test_recruit_event(httpx_mock: HTTPXMock) -> None:
 
     title = "ARCOMM RECRUIT EVENT"
     notification = mock_calendar_notification(title)
-    response = client.post("/slack/", json=notification.dict())
+    await slack.process_event(notification.event)
+    await outbox.drain()
 
-    assert response.status_code == HTTP_200_OK
     assert (
         httpx_mock.get_request().content.decode()
         == ResponseData(
@@ -183,3 +197,66 @@ def test_recruit_event(httpx_mock: HTTPXMock) -> None:
             ],
         ).json()
     )
+
+
+@pytest.mark.asyncio
+async def test_event_digest(httpx_mock: HTTPXMock) -> None:
+    httpx_mock.add_response(
+        method="POST",
+        url=f"{CHANNELS_URL}/{settings.OP_CHANNEL}/messages",
+        status_code=HTTP_200_OK,
+    )
+
+    notification = mock_calendar_notification("ARCOMM RECRUIT EVENT")
+    notification.event.attachments += mock_calendar_notification("ARCOMM random kind of event").event.attachments
+    await slack.process_event(notification.event)
+    await outbox.drain()
+
+    assert [json.loads(request.content)["embeds"][0]["title"] for request in httpx_mock.get_requests()] == [
+        "ARCOMM RECRUIT EVENT",
+        "ARCOMM random kind of event",
+    ]
+
+
+def signed_post(body: str, timestamp: int | None = None, headers: dict[str, str] = {}) -> Response:
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    digest = hmac.new(settings.SLACK_SIGNING_SECRET.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256)
+    headers = {"X-Slack-Request-Timestamp": timestamp, "X-Slack-Signature": f"v0={digest.hexdigest()}", **headers}
+    return client.post("/slack/", data=body, headers=headers)
+
+
+def test_slack_acknowledges_before_processing() -> None:
+    notification = mock_calendar_notification("ARCOMM RECRUIT EVENT", event_id="Ev123")
+
+    with mock.patch("SvenBot.main.create_background_task", side_effect=lambda coroutine: coroutine.close()) as task:
+        response = signed_post(notification.json())
+        retry = signed_post(notification.json(), headers={"X-Slack-Retry-Num": "1"})
+        other = signed_post(mock_calendar_notification("ARCOMM RECRUIT EVENT", event_id="Ev456").json())
+
+    assert [response.status_code, retry.status_code, other.status_code] == [HTTP_200_OK] * 3
+    assert task.call_count == len([response, other])
+
+
+def test_slack_url_verification() -> None:
+    response = signed_post('{"token": "abc", "challenge": "xyz", "type": "url_verification"}')
+
+    assert response.status_code == HTTP_200_OK
+    assert response.json() == {"challenge": "xyz"}
+
+
+def test_slack_rejects_unsigned_requests() -> None:
+    body = mock_calendar_notification("ARCOMM RECRUIT EVENT").json()
+    stale = int(time.time() - settings.SLACK_REPLAY_WINDOW - 60)
+
+    with mock.patch("SvenBot.main.create_background_task") as task:
+        unsigned = client.post("/slack/", data=body)
+        forged = client.post(
+            "/slack/",
+            data=body,
+            headers={"X-Slack-Request-Timestamp": str(int(time.time())), "X-Slack-Signature": "v0=forged"},
+        )
+        replayed = signed_post(body, timestamp=stale)
+        tampered = signed_post(body, headers={"X-Slack-Signature": "v0=" + "0" * 64})
+
+    assert [r.status_code for r in (unsigned, forged, replayed, tampered)] == [HTTP_401_UNAUTHORIZED] * 4
+    task.assert_not_called()
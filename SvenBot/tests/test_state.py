@@ -0,0 +1,42 @@
+import json
+from json import JSONDecodeError
+from pathlib import Path
+
+import pytest
+
+from SvenBot.config import settings
+from SvenBot.state import StateFile
+
+
+@pytest.mark.asyncio
+async def test_state_file_defaults_and_saves() -> None:
+    state = StateFile("state.json", {"revision": 0})
+
+    assert await state.load() == {"revision": 0}
+    assert not state.path.exists()
+
+    await state.save({"revision": 5})
+
+    assert json.loads(state.path.read_text()) == {"revision": 5}
+    assert list(Path(settings.STATE_DIR).iterdir()) == [state.path]
+
+
+@pytest.mark.asyncio
+async def test_state_file_is_cached() -> None:
+    state = StateFile("state.json", {"revision": 0})
+    state.path.write_text(json.dumps({"revision": 1}))
+
+    loaded = await state.load()
+    loaded["revision"] = 2
+    state.path.write_text(json.dumps({"revision": 3}))
+
+    assert await state.load() == {"revision": 1}
+
+
+@pytest.mark.asyncio
+async def test_state_file_corrupt() -> None:
+    state = StateFile("state.json", {"revision": 0})
+    state.path.write_text('{"revision": 1')
+
+    with pytest.raises(JSONDecodeError):
+        await state.load()
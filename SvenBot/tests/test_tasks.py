@@ -1,10 +1,28 @@
+import json
+from urllib.parse import parse_qsl
+
+import httpx
 import pytest
 from pytest_httpx import HTTPXMock
-from starlette.status import HTTP_200_OK
+from starlette.status import HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR
 
-from SvenBot.config import CHANNELS_URL, settings
+from SvenBot import a3sync, clients, tasks
+from SvenBot.config import CHANNELS_URL, REPO_URL, STEAM_URL, settings
+from SvenBot.database import SteamMod, database
 from SvenBot.main import recruit_task
 from SvenBot.models import ResponseData
+from SvenBot.outbox import outbox
+from SvenBot.resilience import RetryPolicy
+from SvenBot.tasks import (
+    STEAM_FILETYPE_COLLECTION,
+    STEAM_FILETYPE_ITEM,
+    a3sync_task,
+    get_published_file_details,
+    get_steam_mods,
+    parse_steam_changelog,
+    steam_changelog_url,
+    steam_task,
+)
 
 
 @pytest.mark.asyncio
@@ -16,21 +34,175 @@ async def test_recruit_task(httpx_mock: HTTPXMock) -> None:
     )
 
     reply = await recruit_task()
+    await outbox.drain()
     expected = ResponseData(
         content=f"<@&{settings.ADMIN_ROLE}> Post recruitment on <https://www.reddit.com/r/FindAUnit>",
         allowed_mentions={"parse": ["roles"]},
     )
 
-    assert reply == expected
+    assert reply == [expected]
+
+
+@pytest.mark.asyncio
+async def test_get_steam_mods(httpx_mock: HTTPXMock) -> None:
+    collections = {
+        "1": [("10", STEAM_FILETYPE_ITEM), ("2", STEAM_FILETYPE_COLLECTION), ("3", STEAM_FILETYPE_COLLECTION)],
+        "2": [("20", STEAM_FILETYPE_ITEM), ("10", STEAM_FILETYPE_ITEM), ("1", STEAM_FILETYPE_COLLECTION)],
+        "3": [("30", STEAM_FILETYPE_ITEM), ("4", STEAM_FILETYPE_COLLECTION)],
+        "4": [("40", STEAM_FILETYPE_ITEM), ("2", STEAM_FILETYPE_COLLECTION)],
+    }
+    requested: list[list[str]] = []
+
+    def collection_details(request: httpx.Request) -> httpx.Response:
+        form = dict(parse_qsl(request.content.decode()))
+        ids = [form[f"publishedfileids[{i}]"] for i in range(int(form["collectioncount"]))]
+        requested.append(ids)
+
+        details = [
+            {
+                "publishedfileid": collection_id,
+                "children": [
+                    {"publishedfileid": child, "filetype": filetype} for child, filetype in collections[collection_id]
+                ],
+            }
+            for collection_id in ids
+        ]
+        return httpx.Response(HTTP_200_OK, json={"response": {"collectiondetails": details}})
+
+    httpx_mock.add_callback(collection_details, method="POST", url=f"{STEAM_URL}/GetCollectionDetails/v1/")
+
+    mods = await get_steam_mods(1)
+
+    assert mods == ["10", "20", "30", "40"]
+    assert requested == [["1"], ["2", "3"], ["4"]]
+
+
+@pytest.mark.asyncio
+async def test_steam_task(httpx_mock: HTTPXMock) -> None:
+    collection_requests = []
+
+    def collection_details(request: httpx.Request) -> httpx.Response:
+        collection_requests.append(request)
+        children = [{"publishedfileid": mod, "filetype": STEAM_FILETYPE_ITEM} for mod in ("10", "20")]
+        details = [{"publishedfileid": str(settings.STEAM_MODLIST), "children": children}]
+        return httpx.Response(HTTP_200_OK, json={"response": {"collectiondetails": details}})
+
+    def file_details(times: dict[str, int]) -> dict:
+        details = [
+            {"publishedfileid": mod, "title": f"Mod {mod}", "time_updated": time_updated}
+            for mod, time_updated in times.items()
+        ]
+        return {"response": {"publishedfiledetails": details}}
+
+    httpx_mock.add_callback(collection_details, method="POST", url=f"{STEAM_URL}/GetCollectionDetails/v1/")
+    httpx_mock.add_response(
+        method="POST",
+        url=f"{STEAM_URL}/GetPublishedFileDetails/v1/",
+        json=file_details({"10": 100, "20": 100}),
+    )
+    httpx_mock.add_response(
+        method="POST",
+        url=f"{STEAM_URL}/GetPublishedFileDetails/v1/",
+        json=file_details({"10": 200, "20": 100}),
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=steam_changelog_url("10"),
+        text='<div class="changelog headline">Update</div><p>Fixed things</p>',
+    )
+    httpx_mock.add_response(method="POST", url=f"{CHANNELS_URL}/{settings.STAFF_CHANNEL}/messages")
+
+    # The first check only records what's there, the second announces what moved since
+    assert await steam_task() is None
+    reply = await steam_task()
+    await outbox.drain()
+
+    assert [message.content for message in reply] == [
+        f"<@&{settings.ADMIN_ROLE}>\n**Mod 10** has released a new version\n<{steam_changelog_url('10')}>\n"
+        "```\nFixed things```\n"
+    ]
+    assert len(collection_requests) == 1
+    with database.session() as session:
+        mod = session.get(SteamMod, "10")
+        assert [mod.time_updated, mod.changelog] == [200, "Fixed things"]
+
+
+@pytest.mark.asyncio
+async def test_get_published_file_details(httpx_mock: HTTPXMock, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "STEAM_DETAILS_CHUNK_SIZE", 2)
+    monkeypatch.setattr(clients.registry.for_url(httpx.URL(STEAM_URL)), "retry", RetryPolicy(base_delay=0))
+    attempts: dict[str, int] = {}
+
+    def file_details(request: httpx.Request) -> httpx.Response:
+        form = dict(parse_qsl(request.content.decode()))
+        ids = [form[f"publishedfileids[{i}]"] for i in range(int(form["itemcount"]))]
+        attempts[ids[0]] = attempts.get(ids[0], 0) + 1
+
+        # The first chunk recovers when retried, the second keeps failing, and the third has a missing item
+        if (ids[0] == "10" and attempts["10"] == 1) or ids[0] == "30":
+            return httpx.Response(HTTP_500_INTERNAL_SERVER_ERROR)
+        details = [
+            {"publishedfileid": mod, "result": 1, "time_updated": 100} if mod != "60" else {"publishedfileid": mod}
+            for mod in ids
+        ]
+        return httpx.Response(HTTP_200_OK, json={"response": {"publishedfiledetails": details}})
+
+    httpx_mock.add_callback(file_details, method="POST", url=f"{STEAM_URL}/GetPublishedFileDetails/v1/")
+
+    details, unchecked = await get_published_file_details(["10", "20", "30", "40", "50", "60"])
+
+    assert [mod["publishedfileid"] for mod in details] == ["10", "20", "50"]
+    assert unchecked == ["30", "40", "60"]
+    assert attempts == {"10": 2, "30": 3, "50": 1}
 
 
-# @pytest.mark.asyncio
-# async def test_a3sync_task():
-#     reply = await a3sync_task()
-#     expected = ResponseData(content=f"",
-#                             allowed_mentions={'parse': []})
-#
-#     assert reply == expected
+def test_parse_steam_changelog() -> None:
+    html = """
+    <html><body>
+        <p>Subscribe to download</p>
+        <div class="detailBox workshopAnnouncement">
+            <div class="changelog headline">Update: 1 Jan @ 12:00pm</div>
+            <p id="123">Fixed things<br>Added things</p>
+        </div>
+        <div class="detailBox workshopAnnouncement">
+            <div class="changelog headline">Update: 1 Dec @ 12:00pm</div>
+            <p id="122">Older changes</p>
+        </div>
+    </body></html>
+    """
+
+    assert parse_steam_changelog(html) == "Fixed things\nAdded things"
+
+
+@pytest.mark.asyncio
+async def test_a3sync_task(httpx_mock: HTTPXMock) -> None:
+    await tasks.revision_state.save({"revision": 1})
+
+    changelogs = [
+        {"revision": 1, "newAddons": ["@old"], "deletedAddons": [], "updatedAddons": []},
+        {"revision": 2, "newAddons": [], "deletedAddons": [], "updatedAddons": []},
+        {"revision": 3, "newAddons": ["@new"], "deletedAddons": ["@gone"], "updatedAddons": []},
+    ]
+    httpx_mock.add_response(method="GET", url=f"{REPO_URL}/repo", json={"revision": 3, "totalFilesSize": 2500000000})
+    httpx_mock.add_response(method="GET", url=f"{REPO_URL}/changelog", json={"list": changelogs})
+    httpx_mock.add_response(method="POST", url=f"{CHANNELS_URL}/{settings.ANNOUNCE_CHANNEL}/messages")
+
+    reply = await a3sync_task()
+    await outbox.drain()
+
+    assert [message.content for message in reply] == [
+        "```md\n# The A3Sync repo has changed #\n\n[2.5 GB]\n```\n```md\n< New >\n@new\n\n< Deleted >\n@gone\n```\n"
+    ]
+    assert json.loads(tasks.revision_state.path.read_text()) == {"revision": 3}
+    assert [revision.revision for revision in await a3sync.get_revisions(0)] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_a3sync_task_unchanged(httpx_mock: HTTPXMock) -> None:
+    tasks.revision_state.path.write_text(json.dumps({"revision": 3}))
+    httpx_mock.add_response(method="GET", url=f"{REPO_URL}/repo", json={"revision": 3, "totalFilesSize": 0})
+
+    assert await a3sync_task() is None
 
 
 if __name__ == "__main__":
@@ -1,37 +1,162 @@
+import asyncio
+import itertools
 import logging
-import re
-from collections.abc import Callable, Coroutine
+import time
+from collections.abc import AsyncIterator, Callable, Coroutine
 from datetime import datetime, timedelta
+from functools import partial
 from typing import Any
 from zoneinfo import ZoneInfo
 
 import httpx
-from starlette.status import HTTP_200_OK, HTTP_204_NO_CONTENT
+from starlette.status import HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR
 
+from SvenBot import clients, metrics
+from SvenBot.cache import AsyncTTLCache, shared_backend
+from SvenBot.clients import UpstreamStats
 from SvenBot.config import (
-    ARCHUB_API,
-    ARCHUB_HEADERS,
-    CHANNELS_URL,
     DEFAULT_HEADERS,
+    DISCORD_HOST,
     GUILD_URL,
+    WEBHOOKS_URL,
     settings,
 )
-from SvenBot.models import Embed, InteractionResponse, InteractionResponseType, ResponseData
+from SvenBot.models import Choice, InteractionResponse, InteractionResponseType, ResponseData
+from SvenBot.ratelimit import RateLimiter, RateLimitStats
+from SvenBot.resilience import BreakerState
+from SvenBot.roles import MemberIndex, RoleIndex, RoleValidator
 
 gunicorn_logger = logging.getLogger("gunicorn.error")
 
-client = httpx.AsyncClient()
+rate_limiter = RateLimiter(global_limit=max(settings.DISCORD_GLOBAL_LIMIT // settings.WEB_CONCURRENCY, 1))
+
+
+def ratelimit_stat(name: str) -> dict[metrics.Labels, float]:
+    return {(): getattr(rate_limiter.stats, name)}
+
+
+def upstream_stat(name: str) -> dict[metrics.Labels, float]:
+    return {(upstream.name,): getattr(upstream.stats, name) for upstream in clients.registry}
+
+
+def breaker_state() -> dict[metrics.Labels, float]:
+    # One series per state, set for the state the breaker is in, so the breaker's history is easy to graph
+    return {
+        (upstream.name, state.value): float(upstream.breaker.state == state)
+        for upstream in clients.registry
+        for state in BreakerState
+    }
+
+
+def breaker_stat(name: str) -> dict[metrics.Labels, float]:
+    return {(upstream.name,): getattr(upstream.breaker, name) for upstream in clients.registry}
+
+
+def register_metrics() -> None:
+    """Expose the counts the rate limiter, connection pools and breakers keep, read when metrics are rendered."""
+    for name in RateLimitStats.__slots__:
+        metrics.registry.collected(
+            f"svenbot_discord_ratelimit_{name}",
+            f"Discord rate limiter {name.replace('_', ' ')}",
+            (),
+            "counter",
+            partial(ratelimit_stat, name),
+        )
+    for name in UpstreamStats.__slots__:
+        metrics.registry.collected(
+            f"svenbot_upstream_{name}",
+            f"Upstream connection pool {name.replace('_', ' ')}",
+            ("upstream",),
+            "gauge" if name.startswith("max_") else "counter",
+            partial(upstream_stat, name),
+        )
+    metrics.registry.collected(
+        "svenbot_upstream_breaker_state",
+        "Whether an upstream's circuit breaker is in a state",
+        ("upstream", "state"),
+        "gauge",
+        breaker_state,
+    )
+    metrics.registry.collected(
+        "svenbot_upstream_breaker_failures",
+        "Consecutive failed requests to an upstream, counted by its circuit breaker",
+        ("upstream",),
+        "gauge",
+        partial(breaker_stat, "failures"),
+    )
+    metrics.registry.collected(
+        "svenbot_upstream_breaker_trips",
+        "Times an upstream's circuit breaker has opened",
+        ("upstream",),
+        "counter",
+        partial(breaker_stat, "trips"),
+    )
+
+
+register_metrics()
+
+MEMBER_PAGE_SIZE = 1000
+# Message flag that shows a message only to the user who ran the command
+EPHEMERAL_FLAG = 1 << 6
+
+background_tasks: set[asyncio.Task] = set()
+
+member_cache: AsyncTTLCache[str, MemberIndex] = AsyncTTLCache(
+    ttl=settings.MEMBER_CACHE_TTL,
+    stale_ttl=settings.MEMBER_CACHE_STALE_TTL,
+    backend=shared_backend(
+        "members",
+        settings.MEMBER_CACHE_SIZE,
+        MemberIndex.as_dict,
+        lambda _guild_id, index: MemberIndex.from_dict(index),
+    ),
+)
 
 
 async def req(
-    function: Callable[..., Coroutine[Any, Any, httpx.Response]],
+    method: str,
     statuses: list[int],
     url: str,
     headers: dict[str, str] = DEFAULT_HEADERS,
+    idempotent: bool | None = None,
     **kwargs: Any,
 ) -> httpx.Response:
-    response = await function(url, headers=headers, **kwargs)
+    upstream = clients.registry.for_url(httpx.URL(url))
+    request = upstream.client.build_request(method, url, headers=headers, **kwargs)
+    retryable = upstream.retry.allows(method, idempotent)
+    start = time.monotonic()
+
+    for attempt in itertools.count():
+        upstream.breaker.before_request()
+        try:
+            if request.url.host == DISCORD_HOST:
+                response = await rate_limiter.request(method, request.url, partial(upstream.send, request))
+            else:
+                response = await upstream.send(request)
+        except httpx.TransportError as e:
+            upstream.breaker.record_failure()
+            delay = upstream.retry.delay(attempt, time.monotonic() - start) if retryable else None
+            if delay is None:
+                metrics.upstream_duration.observe(time.monotonic() - start, upstream.name, method, "error")
+                raise
+            gunicorn_logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.2f}s")
+        else:
+            failed = response.status_code >= HTTP_500_INTERNAL_SERVER_ERROR
+            if failed:
+                upstream.breaker.record_failure()
+            else:
+                upstream.breaker.record_success()
+
+            retry = retryable and response.status_code in upstream.retry.statuses
+            delay = upstream.retry.delay(attempt, time.monotonic() - start) if retry else None
+            if delay is None:
+                break
+            gunicorn_logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
 
+        metrics.upstream_retries.inc(upstream.name)
+        await asyncio.sleep(delay)
+
+    metrics.upstream_duration.observe(time.monotonic() - start, upstream.name, method, str(response.status_code))
     if response.status_code not in statuses:
         gunicorn_logger.error(
             f"Received unexpected status code {response.status_code} (expected {statuses})\n{response.text}",
@@ -41,45 +166,93 @@ async def req(
 
 
 async def get(statuses: list[int], url: str, **kwargs: Any) -> httpx.Response:
-    return await req(client.get, statuses, url, **kwargs)
+    return await req("GET", statuses, url, **kwargs)
 
 
 async def delete(statuses: list[int], url: str, **kwargs: Any) -> httpx.Response:
-    return await req(client.delete, statuses, url, **kwargs)
+    return await req("DELETE", statuses, url, **kwargs)
 
 
 async def put(statuses: list[int], url: str, **kwargs: Any) -> httpx.Response:
-    return await req(client.put, statuses, url, **kwargs)
+    return await req("PUT", statuses, url, **kwargs)
 
 
 async def post(statuses: list[int], url: str, **kwargs: Any) -> httpx.Response:
-    return await req(client.post, statuses, url, **kwargs)
+    return await req("POST", statuses, url, **kwargs)
 
 
 async def patch(statuses: list[int], url: str, **kwargs: Any) -> httpx.Response:
-    return await req(client.patch, statuses, url, **kwargs)
+    return await req("PATCH", statuses, url, **kwargs)
 
 
-async def send_message(
-    channel_id: int,
-    text: str | None = None,
-    mentions: list[str] = [],
-    embeds: list[Embed] | None = None,
+async def webhook_request(
+    function: Callable[..., Coroutine[Any, Any, httpx.Response]],
+    url: str,
+    content: str,
+    attempts: int = 3,
+    ephemeral: bool = False,
 ) -> ResponseData:
-    message = ResponseData(content=text, embeds=embeds, allowed_mentions={"parse": mentions})
-    await post([HTTP_200_OK], f"{CHANNELS_URL}/{channel_id}/messages", json=message.dict())
+    message = ResponseData(content=content, allowed_mentions={"parse": []})
+    if ephemeral:
+        message.flags = EPHEMERAL_FLAG
+
+    # Discord may not have registered the interaction response yet if this follows it closely
+    for attempt in range(attempts):
+        r = await function([HTTP_200_OK, HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND], url, json=message.dict())
+        if r.status_code != HTTP_404_NOT_FOUND:
+            break
+        if attempt == attempts - 1:
+            raise RuntimeError(f"Interaction webhook not found: {r.text}")
+        await asyncio.sleep(0.5 * (attempt + 1))
 
     return message
 
 
+async def edit_original_response(application_id: str, token: str, content: str) -> ResponseData:
+    return await webhook_request(patch, f"{WEBHOOKS_URL}/{application_id}/{token}/messages/@original", content)
+
+
+async def send_followup(application_id: str, token: str, content: str, ephemeral: bool = False) -> ResponseData:
+    return await webhook_request(post, f"{WEBHOOKS_URL}/{application_id}/{token}", content, ephemeral=ephemeral)
+
+
+def create_background_task(coroutine: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def drain_background_tasks(timeout: float) -> None:
+    if not background_tasks:
+        return
+
+    _, pending = await asyncio.wait(set(background_tasks), timeout=timeout)
+    for task in pending:
+        gunicorn_logger.error(f"Cancelling background task {task.get_name()} on shutdown")
+        task.cancel()
+
+
 def immediate_reply(content: str, mentions: list[str] = [], ephemeral: bool = False) -> InteractionResponse:
     data = ResponseData(content=content, allowed_mentions={"parse": mentions})
     if ephemeral:
-        data.flags = 64
+        data.flags = EPHEMERAL_FLAG
 
     return InteractionResponse(type=InteractionResponseType.CHANNEL_MESSAGE_WITH_SOURCE, data=data)
 
 
+def deferred_reply(ephemeral: bool = False) -> InteractionResponse:
+    data = ResponseData(flags=EPHEMERAL_FLAG) if ephemeral else None
+    return InteractionResponse(type=InteractionResponseType.DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE, data=data)
+
+
+def autocomplete_reply(choices: list[Choice]) -> InteractionResponse:
+    return InteractionResponse(
+        type=InteractionResponseType.APPLICATION_COMMAND_AUTOCOMPLETE_RESULT,
+        data=ResponseData(choices=choices),
+    )
+
+
 def basic_validation(role: dict, bot_position: int) -> bool:
     return role.get("tags", {}).get("bot_id") is None and role["position"] < bot_position
 
@@ -88,52 +261,110 @@ def colour_validation(role: dict, bot_position: int) -> bool:
     return basic_validation(role, bot_position) and role["color"] == 0
 
 
-role_validate_funcs: dict[str, Callable[[dict, int], bool]] = {
+role_validate_funcs: dict[str, RoleValidator] = {
     "342006395010547712": colour_validation,
     "240160552867987475": colour_validation,
     "333316787603243018": basic_validation,
 }
 
 
-async def validate_role(guild_id: str, role: dict, roles: list[dict] | None = None) -> bool:
-    if roles is None:
-        roles = await get_roles(guild_id)
+def build_role_index(guild_id: str, roles: list[dict]) -> RoleIndex:
+    return RoleIndex(roles, settings.CLIENT_ID, role_validate_funcs.get(guild_id))
+
+
+role_cache: AsyncTTLCache[str, RoleIndex] = AsyncTTLCache(
+    ttl=settings.ROLE_CACHE_TTL,
+    stale_ttl=settings.ROLE_CACHE_STALE_TTL,
+    backend=shared_backend("roles", settings.ROLE_CACHE_SIZE, lambda index: index.roles, build_role_index),
+)
 
-    bot_position = -1
-    for r in roles:
-        if r.get("tags", {}).get("bot_id") is not None:
-            if r["tags"]["bot_id"] == settings.CLIENT_ID:
-                bot_position = r["position"]
-                break
 
-    if bot_position == -1:
-        raise RuntimeError("Unable to find bot's role")
+async def validate_role(guild_id: str, role: dict, index: RoleIndex | None = None) -> bool:
+    if index is None:
+        index = await get_role_index(guild_id)
 
-    role_validate = role_validate_funcs.get(guild_id)
-    if role_validate is None:
-        return False
-    return role_validate(role, bot_position)
+    return index.is_valid(role)
 
 
 async def validate_role_by_id(guild_id: str, role_id: str) -> bool:
-    role_matching_role_id = None
-    roles = await get_roles(guild_id)
-    for r in roles:
-        if r["id"] == role_id:
-            role_matching_role_id = r
-            break
+    index = await get_role_index(guild_id)
+    role_matching_role_id = index.by_id.get(role_id)
 
     if role_matching_role_id is None:
         raise RuntimeError("Unable to find role")
 
-    return await validate_role(guild_id, role_matching_role_id, roles)
+    return index.is_valid(role_matching_role_id)
 
 
-async def get_roles(guild_id: str) -> list[dict]:
+async def fetch_roles(guild_id: str) -> list[dict]:
     roles = await get([HTTP_200_OK], f"{GUILD_URL}/{guild_id}/roles")
     return roles.json()
 
 
+async def load_role_index(guild_id: str) -> RoleIndex:
+    roles = await fetch_roles(guild_id)
+
+    current = role_cache.peek(guild_id)
+    if current is not None and current.roles == roles:
+        return current
+    return build_role_index(guild_id, roles)
+
+
+async def get_role_index(guild_id: str) -> RoleIndex:
+    return await role_cache.get(guild_id, partial(load_role_index, guild_id))
+
+
+async def get_roles(guild_id: str) -> list[dict]:
+    index = await get_role_index(guild_id)
+    return index.roles
+
+
+async def invalidate_roles(guild_id: str) -> None:
+    await role_cache.invalidate(guild_id)
+
+
+async def iter_guild_members(guild_id: str, page_size: int) -> AsyncIterator[list[dict]]:
+    after = None
+    while True:
+        params: dict[str, int | str] = {"limit": page_size}
+        if after is not None:
+            params["after"] = after
+        r = await get([HTTP_200_OK], f"{GUILD_URL}/{guild_id}/members", params=params)
+        members = r.json()
+
+        if members:
+            yield members
+        if len(members) < page_size:
+            return
+        after = members[-1]["user"]["id"]
+
+
+async def load_member_index(guild_id: str) -> MemberIndex:
+    index = MemberIndex()
+    async for members in iter_guild_members(guild_id, MEMBER_PAGE_SIZE):
+        index.add_members(members)
+    return index
+
+
+async def get_member_index(guild_id: str) -> MemberIndex:
+    return await member_cache.get(guild_id, partial(load_member_index, guild_id))
+
+
+async def record_role_change(guild_id: str, user_id: str, username: str, role_id: str, joined: bool) -> None:
+    """Patch a worker's own member index rather than fetching the whole member list again.
+
+    One shared between workers is dropped instead, it's cheaper to fetch once than for every worker to decode again.
+    """
+
+    def change(index: MemberIndex) -> None:
+        if joined:
+            index.add_role(user_id, username, role_id)
+        else:
+            index.remove_role(user_id, role_id)
+
+    await member_cache.modify(guild_id, change)
+
+
 async def find_role_by_name(
     guild_id: str,
     query: str,
@@ -141,20 +372,16 @@ async def find_role_by_name(
     exclude_reserved: bool = True,
 ) -> dict | None:
     query = query.lower()
-    roles = await get_roles(guild_id)
-    candidate = None
+    index = await get_role_index(guild_id)
+    candidate = index.by_name.get(query)
 
-    for role in roles:
-        role_name = role["name"].lower()
-        if role_name == query:
-            candidate = role
-            break
-
-        if autocomplete and re.match(re.escape(query), role_name):
-            candidate = role
+    if candidate is None and autocomplete:
+        matches = index.prefix_matches(query, limit=1)
+        if matches:
+            candidate = matches[0]
 
     if exclude_reserved and (candidate is not None):
-        if await validate_role(guild_id, candidate, roles):
+        if index.is_valid(candidate):
             return candidate
         return None
 
@@ -171,13 +398,6 @@ def time_until_optime(modifier: int = 0) -> timedelta:
     return opday - today
 
 
-async def get_operation_missions() -> list[dict]:
-    response = await get([HTTP_200_OK, HTTP_204_NO_CONTENT], f"{ARCHUB_API}/operations/next", headers=ARCHUB_HEADERS)
-    if response.status_code == HTTP_200_OK:
-        return response.json()
-    return []
-
-
 def mission_colour_from_mode(mode: str) -> int:
     match mode:
         case "coop":